@@ -0,0 +1,260 @@
+# this file times every stage of main.py (load, clean, derive, aggregate,
+# sequences, fetch, render) on synthetic datasets of growing size and
+# appends the results to benchmarks/results.jsonl, so runs on different
+# commits can be compared. it connects through the PG* environment
+# variables, see main.connect_from_env, and is meant for a local postgres,
+# not the class database, because the load stage drops and recreates the
+# tables
+#
+#   PGHOST=/tmp/pgdata python benchmark.py --scale 1 10 100
+#
+# --startup instead times how long fresh interpreters take to import the
+# pipeline modules, which is what a cron run of a single stage pays first
+#
+#   python benchmark.py --startup
+#
+# --concurrency times the aggregate and sequences stages scheduled on a
+# connection pool, the way main.py runs them, against one after the other
+# on a single connection
+#
+#   PGHOST=/tmp/pgdata python benchmark.py --concurrency --scale 10
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import generate_data
+import main
+import pool
+import scheduler
+
+STAGES = ["load", "clean", "derive", "aggregate", "sequences", "fetch", "render"]
+
+RESULTS_FILE = os.path.join("benchmarks", "results.jsonl")
+
+# python arguments of each startup measurement, run in a fresh interpreter
+STARTUP_COMMANDS = {
+    "main --help": ["main.py", "--help"],
+    "import main": ["-c", "import main"],
+    "import report_data": ["-c", "import report_data"],
+    "import visualize": ["-c", "import visualize"],
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+# run the pipeline once on the given csv files and time each stage
+# the plots are rendered into plots_dir with no cache, so the repo plots stay
+# as they are
+def run_pipeline(connection, csv_paths, plots_dir):
+    timings = {}
+    tables = None
+    for stage in STAGES:
+        start = time.perf_counter()
+        if stage == "load":
+            main.load_stage(connection, csv_paths)
+        elif stage == "clean":
+            main.clean_stage(connection)
+        elif stage == "derive":
+            main.derive_stage(connection)
+        elif stage == "aggregate":
+            main.aggregate_stage(connection)
+        elif stage == "sequences":
+            main.sequences_stage(connection)
+        elif stage == "fetch":
+            tables = main.fetch_stage(connection)
+        elif stage == "render":
+            main.render_stage(tables, use_cache=False, plots_dir=plots_dir)
+        timings[stage] = time.perf_counter() - start
+    return timings
+
+
+def count_rows(connection):
+    cursor = connection.cursor()
+    cursor.execute("SELECT COUNT(*) FROM volleyball")
+    return cursor.fetchone()[0]
+
+
+def load_results(path=RESULTS_FILE):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_result(result, path=RESULTS_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        f.write(json.dumps(result) + "\n")
+
+
+# print the stage timings next to the last recorded run of the same dataset
+# on another commit
+def print_comparison(result, previous):
+    baseline = next((r for r in reversed(previous)
+                     if r["dataset"] == result["dataset"] and r["commit"] != result["commit"]), None)
+    names = list(result["stages"]) + ["total"]
+    width = max(10, *(len(name) for name in names))
+    header = f"{'stage':<{width}} {'seconds':>9}"
+    if baseline:
+        header += f" {baseline['commit']:>9} {'change':>8}"
+    print(f"\n{result['dataset']} ({result['rows']} rows) on {result['commit']}")
+    print(header)
+    for stage in names:
+        seconds = result["total"] if stage == "total" else result["stages"][stage]
+        line = f"{stage:<{width}} {seconds:9.3f}"
+        if baseline:
+            before = baseline["total"] if stage == "total" else baseline["stages"].get(stage)
+            if before:
+                line += f" {before:9.3f} {(seconds - before) / before:+8.1%}"
+        print(line)
+
+
+def benchmark(scales, data=None, work_dir=None, results_path=RESULTS_FILE):
+    work_dir = work_dir or tempfile.mkdtemp(prefix="volleyball_bench_")
+    previous = load_results(results_path)
+    commit = git_commit()
+
+    datasets = [("custom", data)] if data else [(f"x{scale:g}", None) for scale in scales]
+    connection = main.connect_from_env()
+    results = []
+    for i, (label, csv_paths) in enumerate(datasets):
+        if csv_paths is None:
+            csv_paths = generate_data.generate(out_dir=os.path.join(work_dir, label), scale=scales[i])
+
+        timings = run_pipeline(connection, csv_paths, os.path.join(work_dir, f"plots_{label}"))
+        result = {
+            "commit": commit,
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "dataset": label,
+            "rows": count_rows(connection),
+            "stages": timings,
+            "total": sum(timings.values()),
+        }
+        append_result(result, results_path)
+        print_comparison(result, previous)
+        results.append(result)
+
+    connection.close()
+    return results
+
+
+# best of repeats wall time of every startup command
+def startup_times(repeats=5):
+    timings = {}
+    for name, command in STARTUP_COMMANDS.items():
+        runs = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.run([sys.executable] + command, check=True, stdout=subprocess.DEVNULL)
+            runs.append(time.perf_counter() - start)
+        timings[name] = min(runs)
+    return timings
+
+
+def benchmark_startup(repeats=5, results_path=RESULTS_FILE):
+    previous = load_results(results_path)
+    timings = startup_times(repeats)
+    result = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "dataset": "startup",
+        "rows": 0,
+        "stages": timings,
+        "total": sum(timings.values()),
+    }
+    append_result(result, results_path)
+    print_comparison(result, previous)
+    return result
+
+
+# best of repeats wall time of the stages that only read the derived tables,
+# scheduled on a pool of connections and in sequence on one. the dataset
+# is loaded and derived once before the runs. the scheduled runs call the
+# stages straight from the scheduler, without the checkpoints and csv
+# fingerprints of main.run_database_stages, so both sides time the same work
+def concurrency_times(csv_paths, repeats=5, connections=main.POOL_SIZE):
+    connection_pool = pool.ConnectionPool(main.connect_from_env, connections)
+    with connection_pool.connection() as connection:
+        main.load_stage(connection, csv_paths)
+        main.clean_stage(connection)
+        main.derive_stage(connection)
+
+    def sequences():
+        with connection_pool.connection() as connection:
+            main.sequences_stage(connection)
+
+    tasks = {"aggregate": lambda: main.parallel_aggregate_stage(connection_pool), "sequences": sequences}
+    runs = {"sequential": [], "scheduled": []}
+    for _ in range(repeats):
+        with connection_pool.connection() as connection:
+            start = time.perf_counter()
+            main.aggregate_stage(connection)
+            main.sequences_stage(connection)
+            runs["sequential"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        scheduler.run_tasks(tasks, main.STAGE_DEPENDENCIES)
+        runs["scheduled"].append(time.perf_counter() - start)
+    connection_pool.close()
+    return {name: min(times) for name, times in runs.items()}
+
+
+def benchmark_concurrency(scale, data=None, work_dir=None, repeats=5, connections=main.POOL_SIZE,
+                          results_path=RESULTS_FILE):
+    work_dir = work_dir or tempfile.mkdtemp(prefix="volleyball_bench_")
+    previous = load_results(results_path)
+    label = "custom" if data else f"x{scale:g}"
+    csv_paths = data or generate_data.generate(out_dir=os.path.join(work_dir, label), scale=scale)
+
+    timings = concurrency_times(csv_paths, repeats, connections)
+    connection = main.connect_from_env()
+    result = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "dataset": f"concurrency {label}",
+        "rows": count_rows(connection),
+        "stages": timings,
+        "total": sum(timings.values()),
+    }
+    connection.close()
+    append_result(result, results_path)
+    print_comparison(result, previous)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time each pipeline stage on synthetic data")
+    parser.add_argument("--scale", type=float, nargs="+", default=[1, 10, 100],
+                        help="dataset sizes relative to dataset_full.csv")
+    parser.add_argument("--data", nargs="+", default=None,
+                        help="benchmark these csv files or globs instead of generated data")
+    parser.add_argument("--work-dir", default=None, help="where generated data and plots go")
+    parser.add_argument("--results", default=RESULTS_FILE, help="jsonl file the results are appended to")
+    parser.add_argument("--startup", action="store_true", help="time the module imports instead of the stages")
+    parser.add_argument("--repeats", type=int, default=5,
+                        help="runs per startup or concurrency measurement, the best is kept")
+    parser.add_argument("--concurrency", action="store_true",
+                        help="time the scheduled aggregate and sequences stages against a sequential run "
+                             "on the first --scale")
+    parser.add_argument("--connections", type=main.positive_int, default=main.POOL_SIZE,
+                        help="connections in the pool of the scheduled run")
+    args = parser.parse_args()
+
+    if args.startup:
+        benchmark_startup(args.repeats, args.results)
+    elif args.concurrency:
+        benchmark_concurrency(args.scale[0], args.data, args.work_dir, args.repeats, args.connections, args.results)
+    else:
+        benchmark(args.scale, args.data, args.work_dir, args.results)
@@ -0,0 +1,134 @@
+# this file puts bootstrap confidence intervals around the hitting
+# efficiency and the hit type mix (pct_*) of every player and team. it is a
+# Bayesian bootstrap: instead of resampling a player's attacks with
+# replacement, each of the RESAMPLES draws gives them Dirichlet weights,
+# which is smooth and centred on the player's own shares:
+#
+#   - the kill / error / other shares come from one Dirichlet per player
+#   - the hit type shares (pct_*) come from another
+#
+# both are drawn for all players and resamples with one rng.standard_gamma
+# call each. a player who never killed nor erred has nothing to reweight and
+# would get an interval of zero width, so the outcomes get PRIOR extra
+# weight each (the Jeffreys prior). a player with a few attacks still says
+# little, so players with fewer than MIN_ATTEMPTS attempts get no interval
+# of their own and the report says so. a team
+# interval averages the same resamples over all the team's players with an
+# attempt. the seed is fixed so the intervals, and the reports that print
+# them, are the same on every run
+
+import numpy as np
+import pandas as pd
+
+import clean_data
+
+RESAMPLES = 2000
+CONFIDENCE = 0.95
+SEED = 403
+# pseudo count added to the kills, errors and other attacks of a player
+PRIOR = 0.5
+# the fewest attempts a player needs for an interval of their own
+MIN_ATTEMPTS = 5
+
+# the statistics that get an interval, all of them per player and as an
+# average per team
+STATS = ["hitting_efficiency"] + [f"pct_{ht}" for ht in clean_data.HIT_TYPES]
+
+
+# attempts, kills, errors and the attempts of each hit type of every player.
+# the player frame keeps missing values where a count is zero
+def attack_counts(df_players):
+    attempts = df_players["total_hits"].fillna(0).to_numpy(dtype=np.int64)
+    kills = df_players["total_kills"].fillna(0).to_numpy(dtype=np.int64)
+    errors = df_players["total_hit_errors"].fillna(0).to_numpy(dtype=np.int64)
+    shares = df_players[STATS[1:]].to_numpy(dtype=float, na_value=0.0)
+    type_counts = np.rint(shares * attempts[:, None]).astype(np.int64)
+    return attempts, kills, errors, type_counts
+
+
+# every statistic of every player from the counts, players x STATS. they
+# are defined for every player with an attempt, the player rows leave a
+# statistic out when one of its counts is zero (like a player without kills)
+def point_estimates(attempts, kills, errors, type_counts):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = np.column_stack([(kills - errors) / attempts, type_counts / attempts[:, None]])
+    return np.where(attempts[:, None] > 0, values, np.nan)
+
+
+# the shares of every category of every player in every resample,
+# resamples x players x categories. each player's shares are drawn from a
+# Dirichlet with the given parameters, the player's counts, as normalized
+# gamma draws, all players and resamples in one call. a category with a
+# parameter of zero stays at zero. single precision halves the memory and is
+# far finer than the intervals
+def dirichlet_samples(counts, resamples, rng):
+    shape = np.broadcast_to(counts.astype(np.float32), (resamples,) + counts.shape)
+    draws = rng.standard_gamma(shape, dtype=np.float32)
+    return draws / draws.sum(axis=2, keepdims=True)
+
+
+# every statistic of every resample of the given players, resamples x
+# players x STATS, for players with at least one attempt. the efficiency of
+# a resample is its kill share minus its error share
+def bootstrap_samples(attempts, kills, errors, type_counts, resamples=RESAMPLES, seed=SEED):
+    rng = np.random.default_rng(seed)
+    others = np.maximum(attempts - kills - errors, 0)
+    outcomes = dirichlet_samples(np.stack([kills, errors, others], axis=1) + PRIOR, resamples, rng)
+    shares = dirichlet_samples(type_counts, resamples, rng)
+    return np.concatenate([outcomes[..., :1] - outcomes[..., 1:2], shares], axis=2)
+
+
+# the percentile interval of every column of samples
+def percentile_interval(samples, confidence=CONFIDENCE):
+    tail = (1 - confidence) / 2
+    low, high = np.quantile(samples, [tail, 1 - tail], axis=0)
+    return low, high
+
+
+# the estimate and interval columns of every player, <stat>, <stat>_low and
+# <stat>_high, on the index of df_players, and the same for the team
+# averages, avg_<stat>, avg_<stat>_low and avg_<stat>_high indexed by team
+# code. one definition holds for all of them: every player with an attempt
+# has every statistic, computed from their counts, and a team average is the
+# mean over the team's players with an attempt. players with fewer than
+# min_attempts attempts have an estimate but no interval
+def confidence_intervals(df_players, resamples=RESAMPLES, confidence=CONFIDENCE, seed=SEED,
+                         min_attempts=MIN_ATTEMPTS):
+    attempts, kills, errors, type_counts = attack_counts(df_players)
+    estimates = point_estimates(attempts, kills, errors, type_counts)
+    attacked = attempts > 0
+    # only players with an attempt are resampled, they all count towards
+    # their team's interval but only those with min_attempts get their own
+    samples = bootstrap_samples(attempts[attacked], kills[attacked], errors[attacked],
+                                type_counts[attacked], resamples, seed)
+    enough = attempts[attacked] >= min_attempts
+
+    low = np.full(estimates.shape, np.nan)
+    high = np.full(estimates.shape, np.nan)
+    if enough.any():
+        rows = np.flatnonzero(attacked)[enough]
+        low[rows], high[rows] = percentile_interval(samples[:, enough], confidence)
+    player_ci = pd.DataFrame(index=df_players.index)
+    for i, stat in enumerate(STATS):
+        player_ci[stat] = estimates[:, i]
+        player_ci[f"{stat}_low"] = low[:, i]
+        player_ci[f"{stat}_high"] = high[:, i]
+
+    # each team average is a weighted sum over the players with an attempt,
+    # the weights are one over the number of such players of the team
+    team_codes, teams = pd.factorize(df_players["team_name"].astype(object))
+    members = team_codes[attacked, None] == np.arange(len(teams))[None, :]
+    players_per_team = members.sum(axis=0)
+    weights = members / np.maximum(players_per_team, 1)
+    team_means = estimates[attacked].T @ weights
+    # resamples x stats x teams
+    team_samples = samples.transpose(0, 2, 1) @ weights.astype(np.float32)
+    team_low, team_high = percentile_interval(team_samples, confidence)
+
+    team_ci = pd.DataFrame(index=pd.Index(list(teams), name="team_name"))
+    has_players = players_per_team > 0
+    for i, stat in enumerate(STATS):
+        team_ci[f"avg_{stat}"] = np.where(has_players, team_means[i], np.nan)
+        team_ci[f"avg_{stat}_low"] = np.where(has_players, team_low[i], np.nan)
+        team_ci[f"avg_{stat}_high"] = np.where(has_players, team_high[i], np.nan)
+    return player_ci, team_ci
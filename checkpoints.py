@@ -0,0 +1,83 @@
+# this file keeps track of the pipeline stages that finished, so a run can
+# skip or resume the stages whose inputs did not change. every completed
+# stage has a row in pipeline_checkpoints with a fingerprint of its inputs:
+# the csv files, the code the stage runs and the fingerprint of the stage
+# before it, so a change anywhere upstream reruns everything after it
+
+import hashlib
+import os
+
+import load_data
+
+# bytes read at a time when hashing the csv files
+FINGERPRINT_CHUNK_SIZE = 1 << 20
+
+# source files of the code each stage runs, a change to them reruns the stage
+STAGE_SOURCES = {
+    "load": ["load_data.py"],
+    "clean": ["clean_data.py"],
+    "derive": ["load_data.py"],
+    "aggregate": ["clean_data.py"],
+    "sequences": ["sequences.py"],
+}
+
+
+def create_checkpoint_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pipeline_checkpoints (
+            stage TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            completed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+
+
+def hash_file(h, path):
+    with open(path, "rb") as f:
+        for chunk in load_data.read_chunks(f, FINGERPRINT_CHUNK_SIZE):
+            h.update(chunk)
+
+
+# fingerprint of the csv files, by match id and content
+def input_fingerprint(csv_paths):
+    h = hashlib.sha256()
+    for path in load_data.expand_csv_paths(csv_paths):
+        h.update(load_data.match_id_for(path).encode())
+        hash_file(h, path)
+    return h.hexdigest()
+
+
+# fingerprint of every stage, each one chained to the stage before it
+def stage_fingerprints(stages, csv_paths):
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    fingerprints = {}
+    previous = input_fingerprint(csv_paths)
+    for stage in stages:
+        h = hashlib.sha256(f"{previous}:{stage}".encode())
+        for source in STAGE_SOURCES.get(stage, []):
+            hash_file(h, os.path.join(source_dir, source))
+        fingerprints[stage] = previous = h.hexdigest()
+    return fingerprints
+
+
+# fingerprint of every completed stage
+def completed_stages(cursor):
+    cursor.execute("SELECT stage, fingerprint FROM pipeline_checkpoints")
+    return dict(cursor.fetchall())
+
+
+# mark a stage as done. the stages after it were built on the old results,
+# so their checkpoints are removed and they run again on the next resume
+def record_checkpoint(cursor, stage, fingerprint, later_stages=()):
+    cursor.execute("""
+        INSERT INTO pipeline_checkpoints (stage, fingerprint, completed_at)
+        VALUES (%s, %s, now())
+        ON CONFLICT (stage) DO UPDATE
+        SET fingerprint = EXCLUDED.fingerprint,
+            completed_at = EXCLUDED.completed_at
+    """, (stage, fingerprint))
+    cursor.execute("DELETE FROM pipeline_checkpoints WHERE stage = ANY(%s)", (list(later_stages),))
+
+
+def clear_checkpoints(cursor):
+    cursor.execute("DELETE FROM pipeline_checkpoints")
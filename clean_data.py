@@ -1,254 +1,221 @@
 # this files contains functions that clean the data 
 # the primary goal of this is to standardize the categorical text columns
 # and the abreviations so that when we create the visualizations the groupings are clean
-# we also will create additional columns in the tables to use in the visualizations
-
-
-def standardize_columns(cursor):
-    allowed_values = {
-        "team": ["a", "b"],
-        "pass_rating": ["in", "out"],
-        "set_type": ["opposite", "quick", "off_speed", "bic"],
-        "serve_type": ["jump", "float"],
-        "block_touch": ["yes", "no"],
-        "hit_type": ["tip", "roll_shot", "free_ball", "off_speed", "hit", "overpass", "blocked"],
-        "win_reason": ["kill", "hit_error", "serve_error", "tool", "ace", "net"],
-        "lose_reason": ["kill", "hit_error", "serve_error", "tool", "ace", "net"],
-        "winning_team": ["a", "b"]
-    }
-
-    for col, values in allowed_values.items():
-        sql_values = ",".join(f"'{v}'" for v in values)
-        query = f"""
-            UPDATE volleyball
-            SET {col} = CASE
-                WHEN LOWER(TRIM({col})) IN ({sql_values}) THEN LOWER(TRIM({col}))
-                ELSE NULL
-            END
-        """
-        cursor.execute(query)
-
-def replace_empty_strings(cursor):
-    text_columns = [
-        "team", "pass_rating", "set_type", "set_location",
-        "hit_type", "block_touch", "serve_type",
-        "win_reason", "lose_reason", "winning_team"
-    ]
-
-    for col in text_columns:
-        query = f"""
-            UPDATE volleyball
-            SET {col} = NULL
-            WHERE {col} IS NOT NULL AND TRIM({col}) = '';
-        """
-        cursor.execute(query)
-
-
-def player_aggregates(cursor):
-    # create column for kills, errors, hit efficiency
-    cursor.execute("""
-        ALTER TABLE players 
-            ADD COLUMN IF NOT EXISTS total_kills INTEGER ,
-            ADD COLUMN IF NOT EXISTS total_hit_errors INTEGER,
-            ADD COLUMN IF NOT EXISTS hitting_efficiency NUMERIC
-    """)
+# we also will create the statistics views that the visualizations use
 
-    # map the player id, to a jersey number and team name
-    cursor.execute("""
-        WITH player_map AS (
-            SELECT player_id, jersey_number, team_name
-            FROM players
-        )
-        -- total kills
-        UPDATE players p
-        SET total_kills = sub.kills
-        FROM (
-            SELECT pm.player_id, COUNT(*) AS kills
-            FROM volleyball v
-            JOIN player_map pm
-                ON v.hitter_location = pm.jersey_number
-                AND v.team = pm.team_name
-            WHERE v.win_reason = 'kill'
-            GROUP BY pm.player_id
-        ) sub
-        WHERE p.player_id = sub.player_id;
-    """)
 
-    # total hit errors
-    cursor.execute("""
-        UPDATE players p
-        SET total_hit_errors = sub.errors
-        FROM (
-            SELECT pm.player_id, COUNT(*) AS errors
-            FROM volleyball v
-            JOIN players pm
-                ON v.hitter_location = pm.jersey_number
-                AND v.team = pm.team_name
-            WHERE v.win_reason = 'hit_error'
-            GROUP BY pm.player_id
-        ) sub
-        WHERE p.player_id = sub.player_id;
-    """)
+import load_data
 
-    # total hits = kills + errors + other hits
-    cursor.execute("""
-        UPDATE players p
-        SET total_hits = sub.hits
-        FROM (
-            SELECT pm.player_id, COUNT(*) AS hits
-            FROM volleyball v
-            JOIN players pm
-                ON v.hitter_location = pm.jersey_number
-                AND v.team = pm.team_name
-            WHERE v.hit_type IS NOT NULL
-            GROUP BY pm.player_id
-        ) sub
-        WHERE p.player_id = sub.player_id;
-    """)
-
-    # hitting efficiency
-    cursor.execute("""
-        UPDATE players
-        SET hitting_efficiency = CASE
-            WHEN total_hits > 0 THEN (total_kills - total_hit_errors)::NUMERIC / total_hits
-            ELSE NULL
-        END;
-    """)
+# allowed values for each categorical text column, anything else becomes NULL
+ALLOWED_VALUES = {
+    "pass_rating": ["in", "out"],
+    "set_type": ["opposite", "quick", "off_speed", "bic"],
+    "serve_type": ["jump", "float"],
+    "block_touch": ["yes", "no"],
+    "hit_type": ["tip", "roll_shot", "free_ball", "off_speed", "hit", "overpass", "blocked"],
+    "win_reason": ["kill", "hit_error", "serve_error", "tool", "ace", "net"],
+    "lose_reason": ["kill", "hit_error", "serve_error", "tool", "ace", "net"]
+}
 
+HIT_TYPES = ALLOWED_VALUES["hit_type"]
 
-    # hit type percentages
-    hit_types = ['tip', 'roll_shot', 'free_ball', 'off_speed', 'hit', 'overpass', 'blocked']
-    for ht in hit_types:
-        cursor.execute(f"""
-            ALTER TABLE players ADD COLUMN IF NOT EXISTS pct_{ht} NUMERIC;
-            UPDATE players p
-            SET pct_{ht} = sub.cnt::NUMERIC / NULLIF(total_hits, 0)
-            FROM (
-                SELECT pm.player_id, COUNT(*) AS cnt
-                FROM volleyball v
-                JOIN players pm
-                    ON v.hitter_location = pm.jersey_number
-                    AND v.team = pm.team_name
-                WHERE v.hit_type = '{ht}'
-                GROUP BY pm.player_id
-            ) sub
-            WHERE p.player_id = sub.player_id;
-        """)
+# team codes are not a fixed list, any short lowercase code is a team
+# (a, b, ..., aa, ...). the length limit keeps the team_rallies partition
+# names under the identifier limit
+TEAM_COLUMNS = ["team", "winning_team"]
+TEAM_PATTERN = "^[a-z][a-z0-9_]{0,30}$"
 
+# free text columns that are only cleared when they are blank
+FREE_TEXT_COLUMNS = ["set_location"]
 
 
-def team_aggregates(cursor):
-   # add aggregate columns for each of the team tables
-    for table in ['team_a', 'team_b']:
-        cursor.execute(f"""
-            ALTER TABLE {table} 
-                ADD COLUMN IF NOT EXISTS total_kills INTEGER ,
-                ADD COLUMN IF NOT EXISTS total_hit_errors INTEGER,
-                ADD COLUMN IF NOT EXISTS total_hits INTEGER ,
-                ADD COLUMN IF NOT EXISTS hitting_efficiency NUMERIC,
-                ADD COLUMN IF NOT EXISTS total_service_aces INTEGER,
-                ADD COLUMN IF NOT EXISTS total_service_errors INTEGER,
-                ADD COLUMN IF NOT EXISTS service_ace_ratio NUMERIC;
-        """)
-    
-    # total kills per team
-    for table in ['team_a', 'team_b']:
-        cursor.execute(f"""
-            UPDATE {table} t
-            SET total_kills = sub.kills
-            FROM (
-                SELECT t.rally_id, COUNT(*) AS kills
-                FROM {table} t
-                JOIN rallies r ON t.rally_id = r.id
-                WHERE r.win_reason = 'kill'
-                GROUP BY t.rally_id
-            ) sub
-            WHERE t.rally_id = sub.rally_id;
-        """)
+# create the enum type of every categorical column, see
+# load_data.CATEGORY_TYPES. a type that already exists gets any allowed
+# values it is missing, so this is safe to run before every load. new values
+# can only be used after a commit
+def create_category_types(cursor):
+    type_values = {}
+    for col, type_name in load_data.CATEGORY_TYPES.items():
+        type_values.setdefault(type_name, ALLOWED_VALUES[col])
 
-        # total hit errors per team
+    for type_name, values in type_values.items():
+        sql_values = ", ".join(f"'{v}'" for v in values)
         cursor.execute(f"""
-                UPDATE {table} t
-                SET total_hit_errors = sub.errors
-                FROM (
-                    SELECT t.rally_id, COUNT(*) AS errors
-                    FROM {table} t
-                    JOIN rallies r ON t.rally_id = r.id
-                    WHERE r.win_reason = 'hit_error'
-                    GROUP BY t.rally_id
-                ) sub
-                WHERE t.rally_id = sub.rally_id;
-            """)
-   
-        # total hits per rally per team
-        cursor.execute(f"""
-            UPDATE {table} t
-            SET total_hits = sub.hits
-            FROM (
-                SELECT t.rally_id, COUNT(*) AS hits
-                FROM {table} t
-                JOIN rallies r ON t.rally_id = r.id
-                WHERE r.hit_type IS NOT NULL
-                GROUP BY t.rally_id
-            ) sub
-            WHERE t.rally_id = sub.rally_id;
+            DO $$
+            BEGIN
+                CREATE TYPE {type_name} AS ENUM ({sql_values});
+            EXCEPTION WHEN duplicate_object THEN NULL;
+            END $$
         """)
-
-        # team hitting efficiency
-        cursor.execute(f"""
-            UPDATE {table}
-            SET hitting_efficiency = CASE
-                WHEN total_hits > 0 THEN (total_kills - total_hit_errors)::NUMERIC / total_hits
+        for value in values:
+            cursor.execute(f"ALTER TYPE {type_name} ADD VALUE IF NOT EXISTS '{value}'")
+
+
+# sql expression for the cleaned value of a column
+def normalized_expression(col):
+    if col in ALLOWED_VALUES:
+        sql_values = ",".join(f"'{v}'" for v in ALLOWED_VALUES[col])
+        cleaned = f"LOWER(TRIM({col}))"
+        return f"CASE WHEN {cleaned} IN ({sql_values}) THEN {cleaned}::{load_data.CATEGORY_TYPES[col]} ELSE NULL END"
+    if col in TEAM_COLUMNS:
+        cleaned = f"LOWER(TRIM({col}))"
+        return f"CASE WHEN {cleaned} ~ '{TEAM_PATTERN}' THEN {cleaned} ELSE NULL END"
+    if col in FREE_TEXT_COLUMNS:
+        return f"CASE WHEN TRIM({col}) = '' THEN NULL ELSE {col} END"
+    return col
+
+
+# move the raw rows from the staging table into volleyball, trimming,
+# lowercasing and checking every text column against its allowed values on
+# the way, and storing the categorical columns as their enum types. this is
+# one scan of the staging table and one write per row, and it returns how
+# many values were nulled out in each column
+def normalize_columns(cursor):
+    columns = load_data.CSV_COLUMNS + ["match_id"]
+    cleaned_columns = list(ALLOWED_VALUES) + TEAM_COLUMNS + FREE_TEXT_COLUMNS
+
+    select_list = ",\n".join(f"                {normalized_expression(col)} AS {col}" for col in columns)
+    raw_list = ",\n".join(f"                {col} AS raw_{col}" for col in cleaned_columns)
+    nulled_counts = ",\n".join(
+        f"            COUNT(*) FILTER (WHERE raw_{col} IS NOT NULL AND {col} IS NULL)" for col in cleaned_columns
+    )
+    cursor.execute(f"""
+        WITH src AS MATERIALIZED (
+            SELECT line_no,
+{select_list},
+{raw_list}
+            FROM volleyball_staging
+        ),
+        moved AS (
+            INSERT INTO volleyball ({", ".join(columns)})
+            SELECT {", ".join(columns)}
+            FROM src
+            ORDER BY line_no
+        )
+        SELECT
+{nulled_counts}
+        FROM src;
+    """)
+    nulled = dict(zip(cleaned_columns, cursor.fetchone()))
+    cursor.execute("TRUNCATE volleyball_staging RESTART IDENTITY")
+
+    for col, count in nulled.items():
+        if count:
+            print(f"Nulled {count} values in {col}")
+    return nulled
+
+
+# counts of kills, hit errors, hits and each hit type, for a grouped query
+def outcome_counts():
+    type_counts = ",\n".join(
+        f"                COUNT(*) FILTER (WHERE hit_type = '{ht}') AS cnt_{ht}" for ht in HIT_TYPES
+    )
+    return f"""COUNT(*) FILTER (WHERE win_reason = 'kill') AS kills,
+                COUNT(*) FILTER (WHERE win_reason = 'hit_error') AS errors,
+                COUNT(*) FILTER (WHERE hit_type IS NOT NULL) AS hits,
+{type_counts}"""
+
+
+# counts of service aces and errors, which are on the first round of a rally
+def serve_counts():
+    return """COUNT(*) FILTER (WHERE round = 1 AND win_reason = 'ace') AS aces,
+                COUNT(*) FILTER (WHERE round = 1 AND win_reason = 'serve_error') AS serve_errors"""
+
+
+# every player with their hitting statistics, from a single grouped scan of
+# team_rallies. a count of zero is stored as NULL, and players who never hit keep
+# the total_hits of the players table
+def player_stats_query():
+    pct_values = ",\n".join(
+        f"            NULLIF(s.cnt_{ht}, 0)::NUMERIC / NULLIF(s.hits, 0) AS pct_{ht}" for ht in HIT_TYPES
+    )
+    return f"""
+        SELECT p.player_id, p.jersey_number, p.team_name,
+            CASE WHEN s.hits > 0 THEN s.hits ELSE p.total_hits END AS total_hits,
+            p.total_passes, p.total_digs, p.total_blocks,
+            NULLIF(s.kills, 0) AS total_kills,
+            NULLIF(s.errors, 0) AS total_hit_errors,
+            CASE
+                WHEN s.hits > 0 THEN (NULLIF(s.kills, 0) - NULLIF(s.errors, 0))::NUMERIC / s.hits
                 ELSE NULL
-            END;
-        """)
-
-        # hit type percentages
-        hit_types = ['tip', 'roll_shot', 'free_ball', 'off_speed', 'hit', 'overpass', 'blocked']
-        for ht in hit_types:
-            # add a column in the table for each hit type percentage
-            cursor.execute(f"""
-                ALTER TABLE {table} ADD COLUMN IF NOT EXISTS pct_{ht} NUMERIC;
-            """)
-
-        # calculate percentages
-        for ht in hit_types:
-            cursor.execute(f"""
-                UPDATE {table} t
-                SET pct_{ht} = sub.cnt::NUMERIC / NULLIF(total_hits, 0)
-                FROM (
-                    SELECT t.rally_id, COUNT(*) AS cnt
-                    FROM {table} t
-                    JOIN rallies r ON t.rally_id = r.id
-                    WHERE r.hit_type = '{ht}'
-                    GROUP BY t.rally_id
-                ) sub
-                WHERE t.rally_id = sub.rally_id;
-            """)
-
-        # service aces / service errors
-        team_code = 'a' if table == 'team_a' else 'b'
-        cursor.execute(f"""
-            WITH service_counts AS (
-                SELECT
-                    COUNT(*) AS total_service_aces,
-                    COUNT(*) FILTER (WHERE r.win_reason = 'serve_error') AS total_service_errors
-                FROM rallies r
-                WHERE r.round = 1
-                AND r.team = '{team_code}'
-                AND r.win_reason IN ('ace', 'serve_error')
-            )
-            UPDATE {table}
-            SET total_service_aces = sc.total_service_aces,
-                total_service_errors = sc.total_service_errors,
-                service_ace_ratio = CASE 
-                                    WHEN sc.total_service_errors > 0 
-                                    THEN sc.total_service_aces::NUMERIC / sc.total_service_errors 
-                                    ELSE 0 
-                                    END
-            FROM service_counts sc
-            WHERE 1=1;
-        """)
-
-
-
+            END AS hitting_efficiency,
+{pct_values}
+        FROM players p
+        LEFT JOIN (
+            SELECT hitter, team_name,
+                {outcome_counts()}
+            FROM team_rallies
+            WHERE hitter IS NOT NULL
+            GROUP BY team_name, hitter
+        ) s ON s.hitter = p.jersey_number AND s.team_name = p.team_name
+    """
+
+
+# one row per team, from a single grouped scan of team_rallies.
+# service aces / errors are counted on the first round of each rally
+def team_stats_query():
+    pct_values = ",\n".join(
+        f"            cnt_{ht}::NUMERIC / NULLIF(hits, 0) AS pct_{ht}" for ht in HIT_TYPES
+    )
+    return f"""
+        SELECT
+            team AS team_name,
+            kills AS total_kills,
+            errors AS total_hit_errors,
+            hits AS total_hits,
+            CASE WHEN hits > 0 THEN (kills - errors)::NUMERIC / hits ELSE NULL END AS hitting_efficiency,
+            aces AS total_service_aces,
+            serve_errors AS total_service_errors,
+            CASE WHEN serve_errors > 0 THEN aces::NUMERIC / serve_errors ELSE 0 END AS service_ace_ratio,
+{pct_values}
+        FROM (
+            SELECT team_name AS team,
+                {outcome_counts()},
+                {serve_counts()}
+            FROM team_rallies
+            GROUP BY team_name
+        ) sub
+    """
+
+
+# the statistics materialized views, each with the query that defines it and
+# the unique key that REFRESH ... CONCURRENTLY needs
+STATS_VIEWS = {
+    "player_stats": (player_stats_query, "player_id"),
+    "team_stats": (team_stats_query, "team_name"),
+}
+
+
+# create the statistics views, or refresh them if they already exist.
+# a concurrent refresh builds the new contents next to the old ones and swaps
+# them in, so readers never block on it and never see a half updated view
+def update_stats_views(cursor):
+    for name in STATS_VIEWS:
+        update_stats_view(cursor, name)
+
+
+# build or refresh one of the views. the views read team_rallies and players
+# and nothing else, so each one can be updated on its own connection. both
+# group by team first, so each team's partition is aggregated on its own
+def update_stats_view(cursor, name):
+    query, key = STATS_VIEWS[name]
+    cursor.execute("SET LOCAL enable_partitionwise_aggregate = on")
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+    if cursor.fetchone()[0]:
+        cursor.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {name}")
+    else:
+        cursor.execute(f"CREATE MATERIALIZED VIEW {name} AS {query()} WITH DATA")
+        cursor.execute(f"CREATE UNIQUE INDEX {name}_key_idx ON {name} ({key})")
+    cursor.execute(f"ANALYZE {name}")
+
+
+# print the query plans of the statistics views, to check that they
+# use the indexes from load_data.create_indexes
+def explain_aggregates(cursor):
+    cursor.execute("SET LOCAL enable_partitionwise_aggregate = on")
+    for name, (query, key) in STATS_VIEWS.items():
+        cursor.execute("EXPLAIN " + query())
+        print(f"Query plan for {name}:")
+        for (line,) in cursor.fetchall():
+            print(f"  {line}")
+        print()
@@ -0,0 +1,141 @@
+# this file precomputes a dense count tensor of every attack by
+# player x court zone x hit type x outcome, where the zone is the
+# hit_land_location of the attack and the outcome is the win_reason of the
+# touch (or in_play). the tensor is filled with one np.bincount per chunk of
+# rallies, and any combination of player, zone, shot and outcome is then a
+# slice of it instead of a new GROUP BY
+
+import os
+
+import numpy as np
+import pandas as pd
+
+import clean_data
+
+ANALYTICS_DIR = "analytics"
+ZONE_CUBE_FILE = os.path.join(ANALYTICS_DIR, "zone_cube.npz")
+
+HIT_TYPES = clean_data.HIT_TYPES
+# touches without a win_reason were played on
+OUTCOMES = clean_data.ALLOWED_VALUES["win_reason"] + ["in_play"]
+
+
+class ZoneCube:
+    hit_types = HIT_TYPES
+    outcomes = OUTCOMES
+
+    def __init__(self, teams, jerseys, counts):
+        # one entry per player along the first axis, zone z + 1 along the second
+        self.teams = np.asarray(teams, dtype=object)
+        self.jerseys = np.asarray(jerseys, dtype=np.int64)
+        self.counts = counts
+
+    @property
+    def zones(self):
+        return np.arange(1, self.counts.shape[1] + 1)
+
+    def player_index(self, team, jersey):
+        matches = np.flatnonzero((self.teams == team) & (self.jerseys == jersey))
+        if not len(matches):
+            raise KeyError(f"No attacks for player {jersey} of team {team}")
+        return matches[0]
+
+    # the counts of one team or one player, zone x hit type x outcome
+    def team_counts(self, team):
+        return self.counts[self.teams == team].sum(axis=0)
+
+    def player_counts(self, team, jersey):
+        return self.counts[self.player_index(team, jersey)]
+
+    # number of attacks for any combination, None sums over that axis
+    def count(self, team=None, jersey=None, zone=None, hit_type=None, outcome=None):
+        counts = self.counts
+        if jersey is not None:
+            counts = counts[[self.player_index(team, jersey)]]
+        elif team is not None:
+            counts = counts[self.teams == team]
+        if zone is not None:
+            counts = counts[:, [zone - 1]]
+        if hit_type is not None:
+            counts = counts[:, :, [HIT_TYPES.index(hit_type)]]
+        if outcome is not None:
+            counts = counts[:, :, :, [OUTCOMES.index(outcome)]]
+        return int(counts.sum())
+
+    # whether every player of the cube has a row in df_players. a cube saved
+    # by an earlier run can be from other data
+    def matches_players(self, df_players):
+        players = set(zip(df_players["team_name"].astype(str), df_players["jersey_number"].astype(int)))
+        return set(zip(self.teams, self.jerseys.tolist())) <= players
+
+    def save(self, path=ZONE_CUBE_FILE):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez_compressed(path, teams=self.teams.astype(str), jerseys=self.jerseys, counts=self.counts,
+                            hit_types=np.array(HIT_TYPES), outcomes=np.array(OUTCOMES))
+        print(f"Zone cube saved as {path}")
+        return path
+
+    @classmethod
+    def load(cls, path=ZONE_CUBE_FILE):
+        with np.load(path) as data:
+            if list(data["hit_types"]) != HIT_TYPES or list(data["outcomes"]) != OUTCOMES:
+                raise ValueError(f"{path} was built for other hit types or outcomes, rebuild it")
+            return cls(data["teams"].astype(object), data["jerseys"], data["counts"])
+
+
+# consumer that adds chunks of rallies to the cube, see report_data.consume.
+# new players and zones grow the tensor, the rest is a single bincount
+# over the span of the tensor the chunk touches
+class ZoneCubeBuilder:
+    def __init__(self):
+        self.players = {}
+        self.counts = np.zeros((0, 0, len(HIT_TYPES), len(OUTCOMES)), dtype=np.int64)
+
+    def __call__(self, chunk):
+        attacks = chunk[chunk["team"].notna() & chunk["hitter_location"].notna()
+                        & chunk["hit_land_location"].ge(1).fillna(False) & chunk["hit_type"].notna()]
+        if attacks.empty:
+            return
+
+        keys = pd.MultiIndex.from_arrays([attacks["team"].astype(str), attacks["hitter_location"].astype(np.int64)])
+        codes, uniques = keys.factorize()
+        for key in uniques:
+            self.players.setdefault(key, len(self.players))
+        player = np.array([self.players[key] for key in uniques], dtype=np.int64)[codes]
+
+        zone = attacks["hit_land_location"].to_numpy(dtype=np.int64) - 1
+        hit_type = pd.Categorical(attacks["hit_type"], categories=HIT_TYPES).codes.astype(np.int64)
+        outcome = pd.Categorical(attacks["win_reason"], categories=OUTCOMES).codes.astype(np.int64)
+        outcome[outcome < 0] = OUTCOMES.index("in_play")
+
+        self.grow(len(self.players), zone.max() + 1)
+        num_players, num_zones, num_hit_types, num_outcomes = self.counts.shape
+        packed = ((player * num_zones + zone) * num_hit_types + hit_type) * num_outcomes + outcome
+        # only the span of the tensor the chunk touches is counted, not the
+        # whole tensor
+        low = packed.min()
+        span = np.bincount(packed - low)
+        self.counts.reshape(-1)[low:low + span.size] += span
+
+    # pad the player and zone axes with zeros
+    def grow(self, num_players, num_zones):
+        extra_players = max(num_players - self.counts.shape[0], 0)
+        extra_zones = max(num_zones - self.counts.shape[1], 0)
+        if extra_players or extra_zones:
+            self.counts = np.pad(self.counts, ((0, extra_players), (0, extra_zones), (0, 0), (0, 0)))
+
+    # the cube with its players sorted by team and jersey number
+    def cube(self):
+        keys = list(self.players)
+        order = sorted(range(len(keys)), key=lambda i: keys[i])
+        teams = [keys[i][0] for i in order]
+        jerseys = [keys[i][1] for i in order]
+        return ZoneCube(teams, jerseys, self.counts[order])
+
+
+# build the cube from an iterable of rally frames in one pass
+def build_cube(frames):
+    builder = ZoneCubeBuilder()
+    for frame in frames:
+        builder(frame)
+    return builder.cube()
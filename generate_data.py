@@ -0,0 +1,102 @@
+# this file generates synthetic rally csv files in the same format as
+# dataset_full.csv, for testing how the pipeline scales.
+#
+# whole rallies are resampled from the seed file (a block bootstrap), so the
+# joint distribution of rounds, locations, shots and outcomes inside a rally
+# stays the same as in the real data. each output file is one match between
+# two teams drawn from a league of --teams teams
+#
+#   python generate_data.py --scale 10 --out synthetic/x10
+#   python generate_data.py --scale 100 --matches 500 --teams 12 --out synthetic/x100
+
+import argparse
+import itertools
+import os
+import string
+
+import numpy as np
+import pandas as pd
+
+# columns that hold a team code
+TEAM_COLUMNS = ["team", "winning_team"]
+
+
+# team codes for a league of n teams: a, b, ..., z, aa, ab, ...
+def team_codes(n):
+    codes = []
+    width = 1
+    while len(codes) < n:
+        codes += ["".join(letters) for letters in itertools.product(string.ascii_lowercase, repeat=width)]
+        width += 1
+    return codes[:n]
+
+
+# start row and length of every rally in the seed file
+def rally_blocks(seed):
+    starts = np.flatnonzero(seed["rally"].ne(seed["rally"].shift()).to_numpy())
+    lengths = np.diff(np.append(starts, len(seed)))
+    return starts, lengths
+
+
+# row indices of the sampled rallies, laid end to end
+def block_rows(starts, lengths, picks):
+    picked_lengths = lengths[picks]
+    offsets = np.arange(picked_lengths.sum()) - np.repeat(np.cumsum(picked_lengths) - picked_lengths, picked_lengths)
+    return np.repeat(starts[picks], picked_lengths) + offsets, picked_lengths
+
+
+def generate_match(seed, starts, lengths, num_rallies, home, away, rng):
+    picks = rng.integers(0, len(starts), size=num_rallies)
+    rows, picked_lengths = block_rows(starts, lengths, picks)
+
+    match = seed.iloc[rows].reset_index(drop=True)
+    match["rally"] = np.repeat(np.arange(1, num_rallies + 1), picked_lengths)
+
+    # side a of the seed data becomes the home team, side b the away team
+    for col in TEAM_COLUMNS:
+        side = match[col].str.strip().str.lower()
+        match[col] = side.map({"a": home, "b": away}).fillna(match[col])
+    return match
+
+
+# write scale times the rows of the seed file, spread over num_matches files
+def generate(seed_path="dataset_full.csv", out_dir="synthetic", scale=10,
+             num_matches=None, num_teams=2, seed=0):
+    seed_df = pd.read_csv(seed_path, dtype=str, keep_default_na=False)
+    starts, lengths = rally_blocks(seed_df)
+    rng = np.random.default_rng(seed)
+
+    total_rallies = int(round(len(starts) * scale))
+    num_matches = num_matches or max(1, int(round(scale)))
+    rallies_per_match = np.full(num_matches, total_rallies // num_matches)
+    rallies_per_match[:total_rallies % num_matches] += 1
+
+    teams = team_codes(num_teams)
+    os.makedirs(out_dir, exist_ok=True)
+
+    paths = []
+    total_rows = 0
+    for i, num_rallies in enumerate(rallies_per_match):
+        home, away = rng.choice(teams, size=2, replace=False)
+        match = generate_match(seed_df, starts, lengths, int(num_rallies), home, away, rng)
+
+        path = os.path.join(out_dir, f"match_{i + 1:05d}.csv")
+        match.to_csv(path, index=False)
+        paths.append(path)
+        total_rows += len(match)
+
+    print(f"Wrote {total_rows} rows in {len(paths)} matches to {out_dir}")
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic rally csv files")
+    parser.add_argument("--seed-file", default="dataset_full.csv", help="csv file to resample rallies from")
+    parser.add_argument("--out", default="synthetic", help="directory for the generated match files")
+    parser.add_argument("--scale", type=float, default=10, help="size relative to the seed file, e.g. 10, 100, 1000")
+    parser.add_argument("--matches", type=int, default=None, help="number of match files (default: one per seed file size)")
+    parser.add_argument("--teams", type=int, default=2, help="number of teams in the league")
+    parser.add_argument("--random-seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generate(args.seed_file, args.out, args.scale, args.matches, args.teams, args.random_seed)
@@ -1,93 +1,210 @@
 # this file will load in the data from the csv file and create the table 
 # in the class database for storage
 
+import glob
+import os
+import time
 
-def create_table(cursor):
-    cursor.execute("DROP TABLE IF EXISTS volleyball")
-    cursor.execute("""
-        CREATE TABLE volleyball (
-            rally integer,
-            round integer,
-            team text,
-            recieve_location integer,
-            digger_location integer,
-            pass_land_location integer,
-            hitter_location integer,
-            hit_land_location integer,
-            pass_rating text,
-            set_type text,
-            set_location text,
-            hit_type text,
-            num_blockers integer,
-            block_touch text,
-            serve_type text,
-            win_reason text,
-            lose_reason text,
-            winning_team text
+from pg8000.native import literal
+
+# bytes sent to the server per COPY message
+COPY_CHUNK_SIZE = 1 << 16
+
+
+# columns of the csv file, in file order
+CSV_COLUMNS = [
+    "rally", "round", "team", "recieve_location", "digger_location",
+    "pass_land_location", "hitter_location", "hit_land_location",
+    "pass_rating", "set_type", "set_location", "hit_type", "num_blockers",
+    "block_touch", "serve_type", "win_reason", "lose_reason", "winning_team"
+]
+
+# sql type of every column of volleyball and volleyball_staging
+VOLLEYBALL_COLUMN_TYPES = {
+    "rally": "integer",
+    "round": "integer",
+    "team": "text",
+    "recieve_location": "integer",
+    "digger_location": "integer",
+    "pass_land_location": "integer",
+    "hitter_location": "integer",
+    "hit_land_location": "integer",
+    "pass_rating": "text",
+    "set_type": "text",
+    "set_location": "text",
+    "hit_type": "text",
+    "num_blockers": "integer",
+    "block_touch": "text",
+    "serve_type": "text",
+    "win_reason": "text",
+    "lose_reason": "text",
+    "winning_team": "text",
+    "match_id": "text",
+}
+
+# enum type of each categorical column, created from clean_data.ALLOWED_VALUES
+# by clean_data.create_category_types. columns with the same values share a type.
+# team codes are not fixed, they stay text, see clean_data.TEAM_PATTERN
+CATEGORY_TYPES = {
+    "pass_rating": "pass_rating_code",
+    "set_type": "set_type_code",
+    "hit_type": "hit_type_code",
+    "serve_type": "serve_type_code",
+    "block_touch": "block_touch_code",
+    "win_reason": "outcome_code",
+    "lose_reason": "outcome_code",
+}
+
+
+# column list for a create table statement. the staging table keeps the raw
+# text, volleyball stores the categorical columns as enums
+def column_definitions(categorical=True):
+    return ",\n".join(
+        f"            {col} {CATEGORY_TYPES[col] if categorical and col in CATEGORY_TYPES else sql_type}"
+        for col, sql_type in VOLLEYBALL_COLUMN_TYPES.items()
+    )
+
+
+# replace=False keeps the rows that are already loaded, for incremental runs.
+# the enum types of CATEGORY_TYPES have to exist already
+def create_table(cursor, replace=True):
+    if replace:
+        cursor.execute("DROP TABLE IF EXISTS volleyball")
+    # row_id follows the order of the rows in the csv files and is carried
+    # into rallies as source_row
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS volleyball (
+            row_id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+{column_definitions()}
+        )
+    """)
+
+    # the csv is copied into the staging table as is, and clean_data moves
+    # it into volleyball. line_no keeps the order of the rows in the file
+    cursor.execute("DROP TABLE IF EXISTS volleyball_staging")
+    cursor.execute(f"""
+        CREATE UNLOGGED TABLE volleyball_staging (
+            line_no bigint GENERATED ALWAYS AS IDENTITY,
+{column_definitions(categorical=False)}
         )
-    """) 
+    """)
+
+# expand a path, a glob pattern or a list of them into the csv files to load
+def expand_csv_paths(paths):
+    if isinstance(paths, str):
+        paths = [paths]
+
+    files = []
+    for pattern in paths:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            raise FileNotFoundError(f"No CSV files match {pattern}")
+        files.extend(matches)
+    return files
+
+
+# every csv file holds one match, named after the file
+def match_id_for(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+# match ids that are already in the volleyball table
+def loaded_matches(cursor):
+    cursor.execute("SELECT DISTINCT match_id FROM volleyball WHERE match_id IS NOT NULL")
+    return {row[0] for row in cursor.fetchall()}
+
+
+# read a file in fixed size pieces so COPY never holds more than one chunk
+def read_chunks(f, chunk_size=COPY_CHUNK_SIZE):
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def bulk_load_csv(connection, paths="dataset_full.csv", chunk_size=COPY_CHUNK_SIZE):
+    cursor = connection.cursor()
+    copy_sql = f"COPY volleyball_staging ({', '.join(CSV_COLUMNS)}) FROM STDIN WITH (FORMAT csv, HEADER true)"
+
+    total_rows = 0
+    for path in expand_csv_paths(paths):
+        # rows copied from this file get its match id through the column default
+        cursor.execute(f"ALTER TABLE volleyball_staging ALTER COLUMN match_id SET DEFAULT {literal(match_id_for(path))}")
 
-def bulk_load_csv(connection):
-    with open("dataset_full.csv", "r", encoding="utf-8") as f:
-        data = f.read()
+        start = time.perf_counter()
+        # stream the file to COPY FROM STDIN in bounded chunks
+        with open(path, "rb") as f:
+            cursor.execute(copy_sql, stream=read_chunks(f, chunk_size))
+        elapsed = time.perf_counter() - start
 
-    # COPY FROM STDIN using pg8000's conn.run()
-    connection.run("COPY volleyball FROM STDIN WITH (FORMAT csv, HEADER true)", data)
+        rows = cursor.rowcount
+        total_rows += rows
+        print(f"Loaded {rows} rows from {path} ({rows / max(elapsed, 1e-9):,.0f} rows/s)")
 
     print("CSV loaded successfully!")
+    return total_rows
 
 # this section will create the derived tables from the original table 
-def create_derived_tables(cursor):
-    # make sure the tables don't already exist in the database
-    cursor.execute("DROP TABLE IF EXISTS rallies CASCADE")
-    cursor.execute("DROP TABLE IF EXISTS team_a CASCADE")
-    cursor.execute("DROP TABLE IF EXISTS team_b CASCADE")
-    cursor.execute("DROP TABLE IF EXISTS players CASCADE")
+def create_derived_tables(cursor, replace=True):
+    # make sure the tables don't already exist in the database.
+    # the player_stats and team_stats views are made by clean_data.update_stats_views
+    if replace:
+        cursor.execute("DROP TABLE IF EXISTS rallies CASCADE")
+        cursor.execute("DROP TABLE IF EXISTS team_rallies CASCADE")
+        cursor.execute("DROP TABLE IF EXISTS players CASCADE")
+        # the statistics views were dropped with rallies and players, this
+        # removes the team_stats table of databases built before they existed,
+        # like team_a and team_b from before team_rallies
+        cursor.execute("DROP TABLE IF EXISTS team_stats, team_a, team_b CASCADE")
+        # the rally transition counts of sequences.py are counted from
+        # rallies, so they start over with it
+        cursor.execute("DROP TABLE IF EXISTS rally_transitions, transition_matches")
 
     # rally table
     cursor.execute(""" 
-    CREATE TABLE rallies (
+    CREATE TABLE IF NOT EXISTS rallies (
         id SERIAL PRIMARY KEY,
         rally_id INTEGER,          
         team TEXT,
         round INTEGER,
         winning_team TEXT,
-        win_reason TEXT,
-        lose_reason TEXT,
+        win_reason OUTCOME_CODE,
+        lose_reason OUTCOME_CODE,
         receive_location INTEGER,
         pass_land_location INTEGER,
         hitter_location INTEGER,
         hit_land_location INTEGER,
-        pass_rating TEXT,
+        pass_rating PASS_RATING_CODE,
         set_location TEXT,
         num_blockers INTEGER,
-        block_touch TEXT,
-        serve_type TEXT,
-        hit_type TEXT,
-        digger_location INTEGER
+        block_touch BLOCK_TOUCH_CODE,
+        serve_type SERVE_TYPE_CODE,
+        hit_type HIT_TYPE_CODE,
+        digger_location INTEGER,
+        match_id TEXT,
+        source_row BIGINT UNIQUE
     );""")
 
-    # team A table
-    cursor.execute(""" CREATE TABLE team_a (
-        rally_id INTEGER PRIMARY KEY REFERENCES rallies(id),
-        team_name TEXT,
-        receiver INTEGER,
-        digger INTEGER,
-        hitter INTEGER
-    );
-    """)
-
-    # team B table
-    cursor.execute(""" CREATE TABLE team_b (
-        rally_id INTEGER PRIMARY KEY REFERENCES rallies(id),
-        team_name TEXT,
+    # the rallies of every team with the columns the statistics views and
+    # team reports read, one partition per team so a query for one team only
+    # reads its own rows. the partitions are added by create_team_partitions
+    # as new teams show up
+    cursor.execute(""" CREATE TABLE IF NOT EXISTS team_rallies (
+        rally_id INTEGER REFERENCES rallies(id),
+        team_name TEXT NOT NULL,
+        match_id TEXT,
+        round INTEGER,
         receiver INTEGER,
         digger INTEGER,
-        hitter INTEGER
-    );""")
+        hitter INTEGER,
+        hit_type HIT_TYPE_CODE,
+        win_reason OUTCOME_CODE,
+        PRIMARY KEY (team_name, rally_id)
+    ) PARTITION BY LIST (team_name);""")
 
-    # rally table
-    cursor.execute(""" CREATE TABLE players (
+    # player table
+    cursor.execute(""" CREATE TABLE IF NOT EXISTS players (
     player_id SERIAL PRIMARY KEY,
     jersey_number INTEGER,
     team_name TEXT,
@@ -99,69 +216,121 @@ def create_derived_tables(cursor):
     )""")
 
 
-def populate_rallies(cursor):
-    cursor.execute("""
+# indexes for the joins and filters of the statistics views in clean_data.
+# they are built after the bulk load so the load does not maintain them
+INDEXES = {
+    "volleyball_hitter_team_idx": "volleyball (hitter_location, team)",
+    "volleyball_outcome_idx": "volleyball (win_reason, hit_type)",
+    "volleyball_match_idx": "volleyball (match_id)",
+    "team_rallies_round_reason_idx": "team_rallies (team_name, round, win_reason)",
+    "team_rallies_hitter_idx": "team_rallies (team_name, hitter)",
+    "rallies_match_idx": "rallies (match_id)",
+}
+
+
+def create_indexes(cursor):
+    for name, target in INDEXES.items():
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+
+
+# refresh the planner statistics after the tables were (re)filled
+def analyze_tables(cursor):
+    cursor.execute("ANALYZE volleyball, rallies, team_rallies, players")
+
+
+# match_ids limits the insert to the rows of newly loaded matches,
+# otherwise every row of volleyball is used
+def match_filter(match_ids, column="match_id"):
+    if match_ids is None:
+        return "TRUE", ()
+    return f"{column} = ANY(%s)", (list(match_ids),)
+
+
+def populate_rallies(cursor, match_ids=None):
+    where, args = match_filter(match_ids)
+    cursor.execute(f"""
     INSERT INTO rallies (
         rally_id, team, round, winning_team, win_reason, lose_reason,
         receive_location, pass_land_location, hitter_location, hit_land_location,
         pass_rating, set_location, num_blockers, block_touch,
-        serve_type, hit_type, digger_location
+        serve_type, hit_type, digger_location, match_id, source_row
     )
     SELECT 
         rally, team, round, winning_team, win_reason, lose_reason,
         recieve_location, pass_land_location, hitter_location, hit_land_location,
         pass_rating, set_location, num_blockers, block_touch,
-        serve_type, hit_type, digger_location
-    FROM volleyball;
-    """)
+        serve_type, hit_type, digger_location, match_id, row_id
+    FROM volleyball
+    WHERE {where}
+    ORDER BY row_id;
+    """, args)
 
 
-def populate_teamA(cursor):
-    cursor.execute("""WITH numbered_volleyball AS (
-        SELECT *, ROW_NUMBER() OVER () AS rn
-        FROM volleyball
-    ),
-    numbered_rallies AS (
-        SELECT *, ROW_NUMBER() OVER () AS rn
-        FROM rallies
-    )
-    INSERT INTO team_a (rally_id, team_name, receiver, digger, hitter)
-    SELECT r.id, v.team, v.recieve_location, v.digger_location, v.hitter_location
-    FROM numbered_volleyball v
-    JOIN numbered_rallies r ON v.rn = r.rn
-    WHERE v.team = 'a';
+# partition of team_rallies that holds one team. team codes are checked
+# against clean_data.TEAM_PATTERN, so they are safe in an identifier
+def team_partition(team):
+    return f"team_rallies_{team}"
+
+
+# teams that have a partition in team_rallies, in order
+def team_partitions(cursor):
+    cursor.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'team_rallies'::regclass
     """)
+    prefix = team_partition("")
+    return sorted(name[len(prefix):] for (name,) in cursor.fetchall())
 
 
-def populate_teamB(cursor):
-    cursor.execute("""WITH numbered_volleyball AS (
-        SELECT *, ROW_NUMBER() OVER () AS rn
-        FROM volleyball
-    ),
-    numbered_rallies AS (
-        SELECT *, ROW_NUMBER() OVER () AS rn
-        FROM rallies
-    )
-    INSERT INTO team_b (rally_id, team_name, receiver, digger, hitter)
-    SELECT r.id, v.team, v.recieve_location, v.digger_location, v.hitter_location
-    FROM numbered_volleyball v
-    JOIN numbered_rallies r ON v.rn = r.rn
-    WHERE v.team = 'b';
-        """)
-
-
-def populate_players(cursor):
-    cursor.execute("""INSERT INTO players (jersey_number, team_name)
-        SELECT DISTINCT recieve_location AS jersey_number, team
-        FROM volleyball
-        WHERE recieve_location IS NOT NULL
-        UNION
-        SELECT DISTINCT digger_location AS jersey_number, team
-        FROM volleyball
-        WHERE digger_location IS NOT NULL
-        UNION
-        SELECT DISTINCT hitter_location AS jersey_number, team
-        FROM volleyball
-        WHERE hitter_location IS NOT NULL;
-        """)
+# add a partition for every team in rallies that does not have one yet
+def create_team_partitions(cursor, match_ids=None):
+    where, args = match_filter(match_ids)
+    cursor.execute(f"SELECT DISTINCT team FROM rallies WHERE team IS NOT NULL AND {where}", args)
+    teams = {row[0] for row in cursor.fetchall()}
+    for team in sorted(teams - set(team_partitions(cursor))):
+        cursor.execute(f"""CREATE TABLE IF NOT EXISTS {team_partition(team)}
+            PARTITION OF team_rallies FOR VALUES IN ({literal(team)})""")
+    return sorted(teams)
+
 
+# copy each rally row into team_rallies, which routes it to its team's
+# partition. one statement for any number of teams
+def populate_teams(cursor, match_ids=None):
+    create_team_partitions(cursor, match_ids)
+    where, args = match_filter(match_ids)
+    cursor.execute(f"""INSERT INTO team_rallies (rally_id, team_name, match_id, round, receiver, digger,
+        hitter, hit_type, win_reason)
+    SELECT id, team, match_id, round, receive_location, digger_location,
+        hitter_location, hit_type, win_reason
+    FROM rallies
+    WHERE team IS NOT NULL AND {where};
+    """, args)
+
+
+# players that are already in the table are left alone. the unique key
+# treats two NULL teams as different, so ON CONFLICT never fires for a
+# player without a team and those are skipped by the NOT EXISTS instead
+def populate_players(cursor, match_ids=None):
+    where, args = match_filter(match_ids)
+    cursor.execute(f"""INSERT INTO players (jersey_number, team_name)
+        SELECT jersey_number, team FROM (
+            SELECT DISTINCT recieve_location AS jersey_number, team
+            FROM volleyball
+            WHERE recieve_location IS NOT NULL AND {where}
+            UNION
+            SELECT DISTINCT digger_location AS jersey_number, team
+            FROM volleyball
+            WHERE digger_location IS NOT NULL AND {where}
+            UNION
+            SELECT DISTINCT hitter_location AS jersey_number, team
+            FROM volleyball
+            WHERE hitter_location IS NOT NULL AND {where}
+        ) seen
+        WHERE NOT EXISTS (
+            SELECT 1 FROM players p
+            WHERE p.jersey_number = seen.jersey_number AND p.team_name IS NOT DISTINCT FROM seen.team
+        )
+        ON CONFLICT (jersey_number, team_name) DO NOTHING;
+        """, args * 3)
@@ -0,0 +1,187 @@
+# this file builds the players and team statistics straight from the csv files
+# with pandas, without a database. it follows the same cleaning and aggregate
+# rules as load_data and clean_data, so the frames match what
+# report_data.fetch_tables returns after a full database run
+
+import numpy as np
+import pandas as pd
+
+import clean_data
+import load_data
+import report_data
+
+INTEGER_COLUMNS = [
+    "rally", "round", "recieve_location", "digger_location", "pass_land_location",
+    "hitter_location", "hit_land_location", "num_blockers"
+]
+
+
+# read the csv files into one frame with the same column names as volleyball.
+# the raw categorical columns are read as categories, so each distinct
+# spelling is stored once
+def read_csv_files(paths="dataset_full.csv"):
+    dtypes = {col: "Int64" for col in INTEGER_COLUMNS}
+    dtypes.update({col: "category" for col in list(clean_data.ALLOWED_VALUES) + clean_data.TEAM_COLUMNS})
+
+    frames = []
+    for path in load_data.expand_csv_paths(paths):
+        df = pd.read_csv(path, header=0, names=load_data.CSV_COLUMNS, dtype=dtypes)
+        df["match_id"] = load_data.match_id_for(path)
+        frames.append(df)
+    # files with different spellings have different categories, which concat
+    # would turn back into strings
+    df = pd.concat(frames, ignore_index=True)
+    for col in list(clean_data.ALLOWED_VALUES) + clean_data.TEAM_COLUMNS:
+        if df[col].dtype != "category":
+            df[col] = df[col].astype("category")
+    return df
+
+
+# the same rules as clean_data.normalize_columns. the categorical columns are
+# cleaned once per distinct raw value and end up with the dtypes of
+# report_data.CATEGORY_DTYPES
+def normalize_columns(df):
+    df = df.copy()
+    for col, dtype in report_data.CATEGORY_DTYPES.items():
+        raw = df[col].astype("category")
+        cleaned = raw.cat.categories.astype(str).str.strip().str.lower()
+        # code of each raw category in the allowed values, -1 if it is not
+        # allowed. the extra -1 at the end maps missing values (code -1) to missing
+        code_map = np.append(dtype.categories.get_indexer(cleaned), -1)
+        df[col] = pd.Categorical.from_codes(code_map[raw.cat.codes.to_numpy()], dtype=dtype)
+    for col in clean_data.TEAM_COLUMNS:
+        raw = df[col].astype("category")
+        cleaned = raw.cat.categories.astype(str).str.strip().str.lower()
+        cleaned = np.append(cleaned.where(cleaned.str.match(clean_data.TEAM_PATTERN)).to_numpy(object), None)
+        df[col] = pd.Categorical(cleaned[raw.cat.codes.to_numpy()])
+    for col in clean_data.FREE_TEXT_COLUMNS:
+        text = df[col].astype("string")
+        df[col] = text.mask(text.str.strip() == "")
+    return df
+
+
+# count kills, hit errors, hits and each hit type for every group of rows
+def outcome_counts(df, keys):
+    counts = pd.DataFrame({
+        "kills": df["win_reason"].eq("kill"),
+        "errors": df["win_reason"].eq("hit_error"),
+        "hits": df["hit_type"].notna(),
+        **{f"cnt_{ht}": df["hit_type"].eq(ht) for ht in clean_data.HIT_TYPES},
+    }).fillna(False).astype(np.int64)
+    return counts.groupby([df[key] for key in keys], observed=True).sum()
+
+
+# every (jersey number, team) that received, dug or hit, like load_data.populate_players
+def build_players(df):
+    players = pd.concat([
+        df[[col, "team"]].rename(columns={col: "jersey_number", "team": "team_name"})
+        for col in ["recieve_location", "digger_location", "hitter_location"]
+    ])
+    players = players[players["jersey_number"].notna()].drop_duplicates()
+    players = players.sort_values(["team_name", "jersey_number"]).reset_index(drop=True)
+    players.insert(0, "player_id", np.arange(1, len(players) + 1))
+    for col in ["total_hits", "total_passes", "total_digs", "total_blocks"]:
+        players[col] = 0
+
+    # same as clean_data.player_stats_query, a count of zero is stored as NULL
+    hitters = df[df["hitter_location"].notna() & df["team"].notna()]
+    counts = outcome_counts(hitters, ["hitter_location", "team"])
+    counts.index = counts.index.set_names(["jersey_number", "team_name"])
+    counts = counts.replace(0, np.nan)
+
+    stats = pd.DataFrame(index=counts.index)
+    stats["total_kills"] = counts["kills"]
+    stats["total_hit_errors"] = counts["errors"]
+    stats["hits"] = counts["hits"]
+    stats["hitting_efficiency"] = (counts["kills"] - counts["errors"]) / counts["hits"]
+    for ht in clean_data.HIT_TYPES:
+        stats[f"pct_{ht}"] = counts[f"cnt_{ht}"] / counts["hits"]
+
+    players = players.merge(stats.reset_index(), on=["jersey_number", "team_name"], how="left")
+    players["total_hits"] = players["hits"].fillna(players["total_hits"]).astype(np.int64)
+    return players.drop(columns="hits")
+
+
+# one row per team, like clean_data.team_stats_query
+def build_team_stats(df):
+    rows = df[df["team"].notna()]
+    counts = outcome_counts(rows, ["team"])
+    first_round = rows["round"].eq(1).fillna(False)
+    serves = pd.DataFrame({
+        "aces": first_round & rows["win_reason"].eq("ace").fillna(False),
+        "serve_errors": first_round & rows["win_reason"].eq("serve_error").fillna(False),
+    }).astype(np.int64).groupby(rows["team"], observed=True).sum()
+
+    hits = counts["hits"].where(counts["hits"] > 0)
+    stats = pd.DataFrame({
+        "team_name": counts.index,
+        "total_kills": counts["kills"].values,
+        "total_hit_errors": counts["errors"].values,
+        "total_hits": counts["hits"].values,
+        "hitting_efficiency": ((counts["kills"] - counts["errors"]) / hits).values,
+        "total_service_aces": serves["aces"].values,
+        "total_service_errors": serves["serve_errors"].values,
+        "service_ace_ratio": np.where(serves["serve_errors"] > 0,
+                                      serves["aces"] / serves["serve_errors"].where(serves["serve_errors"] > 0), 0.0),
+    })
+    for ht in clean_data.HIT_TYPES:
+        stats[f"pct_{ht}"] = (counts[f"cnt_{ht}"] / hits).values
+    return stats.reset_index(drop=True)
+
+
+# the same frames as report_data.fetch_tables, the players and a summary
+# frame per team
+def build_tables(paths="dataset_full.csv"):
+    df = normalize_columns(read_csv_files(paths))
+    players = build_players(df)
+    df_teams = report_data.team_summaries(players, build_team_stats(df))
+
+    columns = report_data.PLAYER_COLUMNS
+    df_players = players[list(columns)].astype(columns).sort_values(["team_name", "jersey_number"])
+    teams = sorted(df["team"].dropna().unique())
+    return df_players.reset_index(drop=True), report_data.split_teams(df_teams, teams)
+
+
+# compare the local frames with the database tables built from the same csv
+# files. player ids are assigned differently, so players are matched on
+# (team, jersey number). prints every column that differs
+def check_parity(cursor, paths="dataset_full.csv"):
+    local_players, local_teams = build_tables(paths)
+    db_players, db_teams = report_data.fetch_tables(cursor)
+
+    ok = True
+    if set(local_teams) != set(db_teams):
+        print(f"teams differ: {sorted(local_teams)} local, {sorted(db_teams)} in the database")
+        ok = False
+
+    pairs = [("players", local_players, db_players, ["team_name", "jersey_number"])]
+    pairs += [(f"team {team}", local_teams[team], db_teams[team], ["team_name"])
+              for team in sorted(set(local_teams) & set(db_teams))]
+    for name, local, db, key in pairs:
+        columns = [col for col in db.columns if col != "player_id"]
+        missing = set(columns) - set(local.columns)
+        if missing:
+            print(f"{name}: missing columns {sorted(missing)}")
+            ok = False
+            continue
+
+        local = local[columns].sort_values(key).reset_index(drop=True)
+        db = db[columns].sort_values(key).reset_index(drop=True)
+        if len(local) != len(db):
+            print(f"{name}: {len(local)} local rows, {len(db)} database rows")
+            ok = False
+            continue
+
+        for col in columns:
+            if col in key:
+                same = local[col].astype("string").fillna("").equals(db[col].astype("string").fillna(""))
+            else:
+                left = pd.to_numeric(local[col], errors="coerce").astype(float).to_numpy()
+                right = pd.to_numeric(db[col], errors="coerce").astype(float).to_numpy()
+                same = np.allclose(left, right, equal_nan=True)
+            if not same:
+                print(f"{name}: column {col} differs")
+                ok = False
+
+    print("local backend matches the database" if ok else "local backend does not match the database")
+    return ok
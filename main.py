@@ -2,17 +2,30 @@
 # it will load in the data file, create the derived tables,
 # clean the data, and produce meaningful visualizations
 
+import argparse
+import configparser
+import functools
+import os
+import sys
+import time
+
 # external libraries
 import pg8000
 
-# custom libraries
+# custom libraries. report_data, snapshots, court_zones, sequences, visualize
+# and local_backend pull in pandas, pyarrow, matplotlib and seaborn, so they
+# are imported by the stages that use them and load only or aggregate only
+# runs start quickly
+import checkpoints
 import load_data
 import clean_data
-import visualize
+import pool
+import scheduler
+import sql_profile
 
 
 
-def setup():
+def prompt_credentials():
     login = input('Login username: ')
     secret = input('Password: ')
 
@@ -21,47 +34,445 @@ def setup():
                 'database': 'csci403',
                 'host'    : 'ada.mines.edu'}
 
+    return credentials
+
+
+# connection settings and the standard environment variable for each
+ENV_SETTINGS = {"host": "PGHOST", "port": "PGPORT", "user": "PGUSER",
+                "password": "PGPASSWORD", "database": "PGDATABASE"}
+
+
+# connect with host, port, user, password and database settings. a host
+# starting with / is the directory of a unix socket, like a local postgres install
+def connect_with(settings):
+    host = settings.get("host") or "localhost"
+    port = int(settings.get("port") or 5432)
+    credentials = {'user'    : settings.get("user") or "postgres",
+                'password': settings.get("password"),
+                'database': settings.get("database") or "postgres",
+                'port'    : port}
+    if host.startswith("/"):
+        credentials['unix_sock'] = os.path.join(host, f".s.PGSQL.{port}")
+    else:
+        credentials['host'] = host
+
     return pg8000.connect(**credentials)
 
 
+# connect with the standard PGHOST, PGPORT, PGUSER, PGPASSWORD and PGDATABASE
+# variables, for runs without a prompt
+def connect_from_env():
+    return connect_with({key: os.environ.get(var) for key, var in ENV_SETTINGS.items()})
+
+
+# connect with the [database] section of an ini file, for example
+#
+#   [database]
+#   host = ada.mines.edu
+#   user = me
+#   database = csci403
+#
+# settings missing from the file come from the environment, so the password
+# can stay in PGPASSWORD
+def connect_from_config(path):
+    parser = configparser.ConfigParser()
+    if not parser.read(path):
+        raise FileNotFoundError(f"Config file {path} not found")
+    if not parser.has_section("database"):
+        raise ValueError(f"Config file {path} has no [database] section")
+    settings = {key: os.environ.get(var) for key, var in ENV_SETTINGS.items()}
+    settings.update(parser["database"])
+    return connect_with(settings)
+
+
+# a function that opens a new connection, from a config file if one is
+# given, then the environment, and the login prompt only when someone is at
+# the terminal. the prompt is shown once and every connection reuses it
+def connection_factory(config_path=None):
+    if config_path:
+        return functools.partial(connect_from_config, config_path)
+    if any(var in os.environ for var in ENV_SETTINGS.values()):
+        return connect_from_env
+    if sys.stdin.isatty():
+        credentials = prompt_credentials()
+        return functools.partial(pg8000.connect, **credentials)
+    raise SystemExit("No database settings: pass --config or set the PG* environment variables")
+
+
+# the stages of a full run, in order. each one commits its own work
+
+# create the enum types and the table and bulk load the data
+def load_stage(connection, csv_paths):
+    with sql_profile.stage(connection, "load"):
+        cursor = connection.cursor()
+        clean_data.create_category_types(cursor)
+        load_data.create_table(cursor)
+        load_data.bulk_load_csv(connection, csv_paths)
+        connection.commit()
+
+
+# clean the data
+def clean_stage(connection):
+    with sql_profile.stage(connection, "clean"):
+        cursor = connection.cursor()
+        clean_data.normalize_columns(cursor)
+        connection.commit()
+
+
+# create the dervived tables
+def derive_stage(connection):
+    with sql_profile.stage(connection, "derive"):
+        cursor = connection.cursor()
+        load_data.create_derived_tables(cursor)
+        # make sure to not create duplicate entries in the tables
+        cursor.execute("TRUNCATE rallies, team_rallies, players RESTART IDENTITY CASCADE;")
+        load_data.populate_rallies(cursor)
+        load_data.populate_teams(cursor)
+        load_data.populate_players(cursor)
+        load_data.create_indexes(cursor)
+        load_data.analyze_tables(cursor)
+        connection.commit()
+        print("created derived tables")
+
+
+# build or refresh the player and team statistics views
+def aggregate_stage(connection):
+    with sql_profile.stage(connection, "aggregate"):
+        cursor = connection.cursor()
+        clean_data.update_stats_views(cursor)
+        connection.commit()
+        print("updated player and team statistics")
+
+
+# the same as aggregate_stage with each view refreshed on its own connection
+# of the pool at the same time, so it takes as long as the slowest view
+def parallel_aggregate_stage(connection_pool):
+    def update(name):
+        with connection_pool.connection() as connection, sql_profile.stage(connection, "aggregate"):
+            clean_data.update_stats_view(connection.cursor(), name)
+            connection.commit()
+
+    scheduler.run_tasks({name: functools.partial(update, name) for name in clean_data.STATS_VIEWS})
+    print("updated player and team statistics")
+
+
+# count the rally transitions of every match into rally_transitions, see
+# sequences.py. the stage runs again when the counting code changed, so it
+# starts over instead of keeping the old counts. ingest_matches only adds
+# the new matches
+def sequences_stage(connection):
+    import sequences
+
+    with sql_profile.stage(connection, "sequences"):
+        cursor = connection.cursor()
+        sequences.clear_transitions(cursor)
+        match_ids = sequences.update_transitions(cursor)
+        connection.commit()
+        if match_ids:
+            print(f"counted rally transitions of matches: {', '.join(match_ids)}")
+
+
+# fetch the player rows and team summaries as pandas dataframes
+def fetch_stage(connection):
+    import report_data
+
+    with sql_profile.stage(connection, "fetch"):
+        return report_data.fetch_tables(connection.cursor())
+
+
+# write a columnar snapshot of the derived tables, see snapshots.py
+def snapshot_stage(connection):
+    import snapshots
+
+    with sql_profile.stage(connection, "snapshot"):
+        version_dir = snapshots.export_snapshot(connection.cursor())
+        # end the read transaction of the snapshot cursors
+        connection.commit()
+        return version_dir
+
+
+# precompute the court zone cube from rallies streamed from the database,
+# or from rally frames (a snapshot or the pandas backend), and save it
+def zones_stage(connection=None, frames=None):
+    import court_zones
+    import report_data
+
+    with sql_profile.stage(connection, "zones"):
+        if frames is None:
+            frames = report_data.stream_rallies(connection.cursor())
+        cube = court_zones.build_cube(frames)
+        if connection is not None:
+            connection.commit()
+        cube.save()
+        return cube
+
+
+# the stored rally transition counts, or None if they were never counted
+def fetch_transitions(connection):
+    import sequences
+
+    with sql_profile.stage(connection, "fetch"):
+        return sequences.load_counts(connection.cursor())
+
+
+# generate visualizations and scouting report. the zone heatmaps use the
+# cube of the zones stage, or the one it saved last time if it has the same
+# players, and the reports get the rally tendencies of the transition counts
+# when there are some. the files go to plots_dir, visualize.PLOTS_DIR if not
+# given
+def render_stage(tables, use_cache=True, zone_cube=None, transitions=None, player_zones=False, plots_dir=None):
+    import court_zones
+    import visualize
+
+    df_players, team_tables = tables
+    if zone_cube is None and os.path.exists(court_zones.ZONE_CUBE_FILE):
+        saved = time.strftime("%Y-%m-%d %H:%M", time.localtime(os.path.getmtime(court_zones.ZONE_CUBE_FILE)))
+        zone_cube = court_zones.ZoneCube.load()
+        if zone_cube.matches_players(df_players):
+            print(f"using the zone cube saved {saved} in {court_zones.ZONE_CUBE_FILE}")
+        else:
+            print(f"{court_zones.ZONE_CUBE_FILE} (saved {saved}) has other players, "
+                  "run the zones stage to draw zone heatmaps")
+            zone_cube = None
+
+    return visualize.generate_visuals_and_scouting_report(df_players, team_tables, use_cache=use_cache,
+                                                          zone_cube=zone_cube, transitions=transitions,
+                                                          player_zones=player_zones,
+                                                          plots_dir=plots_dir or visualize.PLOTS_DIR)
+
+
+# the database stages in order, the sequences stage counting the rally
+# transitions last, then the snapshot stage that exports the results,
+# the zones stage that precomputes the court zone cube and the report stage
+# that fetches the results and renders them
+DATABASE_STAGES = ["load", "clean", "derive", "aggregate", "sequences"]
+STAGES = DATABASE_STAGES + ["snapshot", "zones", "report"]
+
+# the database stages each one reads the results of. aggregate and
+# sequences both only read the derived tables, so they run at the same time
+STAGE_DEPENDENCIES = {
+    "load": [],
+    "clean": ["load"],
+    "derive": ["clean"],
+    "aggregate": ["derive"],
+    "sequences": ["derive"],
+}
+
+# connections in the pool of a database run
+POOL_SIZE = 4
+
+
+# run the selected database stages on connections of the pool, each one as
+# soon as the stages it depends on are done, and checkpoint each one. with
+# resume, a stage whose checkpoint matches its current fingerprint is skipped
+def run_database_stages(connection_pool, csv_paths, stages=DATABASE_STAGES, resume=False):
+    for stage in DATABASE_STAGES:
+        if stage not in stages:
+            print(f"skipping {stage}")
+    selected = [stage for stage in DATABASE_STAGES if stage in stages]
+    if not selected:
+        return {}
+
+    with connection_pool.connection() as connection:
+        checkpoints.create_checkpoint_table(connection.cursor())
+        connection.commit()
+
+    # fingerprints chain through the stages before each one, so the chain
+    # goes up to the last selected stage and no further
+    chain = DATABASE_STAGES[:DATABASE_STAGES.index(selected[-1]) + 1]
+    fingerprints = checkpoints.stage_fingerprints(chain, csv_paths)
+    stage_functions = {
+        "load": lambda connection: load_stage(connection, csv_paths),
+        "clean": clean_stage,
+        "derive": derive_stage,
+        "sequences": sequences_stage,
+    }
+
+    def run_stage(stage):
+        # the checkpoints are read when the stage is due, a stage that just
+        # ran has removed the ones that depend on it
+        with connection_pool.connection() as connection:
+            if resume and checkpoints.completed_stages(connection.cursor()).get(stage) == fingerprints[stage]:
+                print(f"{stage} is up to date, skipping")
+                return
+        # the views of the aggregate stage take their own connections
+        if stage == "aggregate":
+            parallel_aggregate_stage(connection_pool)
+        else:
+            with connection_pool.connection() as connection:
+                stage_functions[stage](connection)
+        with connection_pool.connection() as connection:
+            checkpoints.record_checkpoint(connection.cursor(), stage, fingerprints[stage],
+                                          scheduler.dependents(STAGE_DEPENDENCIES, stage))
+            connection.commit()
+
+    tasks = {stage: functools.partial(run_stage, stage) for stage in selected}
+    return scheduler.run_tasks(tasks, STAGE_DEPENDENCIES)
+
+
+# drop everything and rebuild the database from the csv files
+def full_rebuild(connection_pool, csv_paths):
+    run_database_stages(connection_pool, csv_paths)
+
+
+# append only the matches that are not loaded yet, refresh the statistics
+# views and add the rally transitions of the new matches. everything but the
+# refresh only touches the new rows. a materialized view can only be
+# refreshed as a whole, so the refresh reads every rally and grows with the
+# number of matches loaded
+def ingest_matches(connection, csv_paths):
+    import sequences
+
+    with sql_profile.stage(connection, "ingest"):
+        cursor = connection.cursor()
+
+        clean_data.create_category_types(cursor)
+        load_data.create_table(cursor, replace=False)
+        load_data.create_derived_tables(cursor, replace=False)
+        connection.commit()
+
+        loaded = load_data.loaded_matches(cursor)
+        new_files = [path for path in load_data.expand_csv_paths(csv_paths)
+                     if load_data.match_id_for(path) not in loaded]
+        if not new_files:
+            print("no new matches to ingest")
+            return
+        match_ids = [load_data.match_id_for(path) for path in new_files]
+
+        load_data.bulk_load_csv(connection, new_files)
+        clean_data.normalize_columns(cursor)
+
+        load_data.populate_rallies(cursor, match_ids)
+        load_data.populate_teams(cursor, match_ids)
+        load_data.populate_players(cursor, match_ids)
+        load_data.create_indexes(cursor)
+        load_data.analyze_tables(cursor)
+
+        clean_data.update_stats_views(cursor)
+        sequences.update_transitions(cursor)
+        # the tables no longer match the files of the last full run
+        checkpoints.create_checkpoint_table(cursor)
+        checkpoints.clear_checkpoints(cursor)
+        connection.commit()
+        print(f"ingested matches: {', '.join(match_ids)}")
+
+
+# argparse type of the counts that need at least one
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive number")
+    return number
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load the volleyball data and build the scouting reports")
+    parser.add_argument("csv_paths", nargs="*", default=["dataset_full.csv"],
+                        help="csv files or glob patterns, one match per file")
+    parser.add_argument("--config", help="ini file with a [database] section (default: PG* variables)")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES,
+                        help="only run these stages")
+    parser.add_argument("--skip", nargs="+", choices=STAGES, default=[],
+                        help="do not run these stages")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip the stages that already finished on the same inputs")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only add the matches that are not loaded yet")
+    parser.add_argument("--explain", action="store_true",
+                        help="print the query plans of the statistics views")
+    parser.add_argument("--local", action="store_true",
+                        help="build the reports with pandas and no database")
+    parser.add_argument("--from-snapshot", nargs="?", const="latest", metavar="VERSION",
+                        help="build the reports from a snapshot (default: the latest) and no database")
+    parser.add_argument("--parity", action="store_true",
+                        help="check the pandas tables against the database after the run")
+    parser.add_argument("--no-cache", dest="use_cache", action="store_false",
+                        help="render every plot and report even if its data did not change")
+    parser.add_argument("--profile", action="store_true",
+                        help="write a ranked report of every sql statement to profile_report.txt")
+    parser.add_argument("--profile-explain", action="store_true",
+                        help="also capture each statement's EXPLAIN (ANALYZE, BUFFERS) plan")
+    parser.add_argument("--player-zones", action="store_true",
+                        help="also draw a zone heatmap for every player")
+    parser.add_argument("--connections", type=positive_int, default=POOL_SIZE,
+                        help="database connections for the stages that run at the same time")
+    args = parser.parse_args(argv)
+    # an incremental run only gets the new csv files, but the database holds
+    # every match loaded before them
+    if args.parity and args.incremental:
+        parser.error("--parity needs every csv file in the database, run it without --incremental")
+    return args
+
+
 if __name__ == "__main__":
-    # establish the connection to the database 
-    connection = setup()
-    cursor = connection.cursor()
-
-    # create the table and bulk load the data
-    load_data.create_table(cursor)
-    load_data.bulk_load_csv(connection)
-    connection.commit()
-
-    # clean the data
-    clean_data.replace_empty_strings(cursor)
-    clean_data.standardize_columns(cursor)
-    connection.commit()
-
-    # create the dervived tables
-    load_data.create_derived_tables(cursor)
-    # make sure to not create duplicate entries in the tables
-    cursor.execute("TRUNCATE rallies, team_a, team_b, players RESTART IDENTITY CASCADE;")
-    load_data.populate_rallies(cursor)
-    load_data.populate_teamA(cursor)
-    load_data.populate_teamB(cursor)
-    load_data.populate_players(cursor)
-    connection.commit()
-    print("created derived tables")
-
-    # add aggregate columns to the tables 
-    clean_data.player_aggregates(cursor)
-    clean_data.team_aggregates(cursor)
-    connection.commit()
-    print("created aggregate player and team columns")
-
-    # fetch tables and create pandas dataframes
-    df_players, df_team_a, df_team_b = visualize.fetch_tables(cursor)
-
-    # create dictionary of team names
-    team_tables = {'A': df_team_a, 'B': df_team_b}
-
-    # generate visualizations and scouting report
-    visualize.generate_visuals_and_scouting_report(df_players, team_tables)
+    args = parse_args()
+    stages = [stage for stage in args.stages if stage not in args.skip]
+    profile = args.profile or args.profile_explain
+    tables = None
+    zone_cube = None
+    transitions = None
+
+    if args.local:
+        import local_backend
+        tables = local_backend.build_tables(args.csv_paths)
+        if "zones" in stages or "sequences" in stages:
+            rallies = local_backend.normalize_columns(local_backend.read_csv_files(args.csv_paths))
+        if "zones" in stages:
+            zone_cube = zones_stage(frames=[rallies])
+        if "sequences" in stages:
+            import sequences
+            # the csv files call the rally number rally and spell receive recieve
+            transitions = sequences.count_frames([rallies.rename(columns={"rally": "rally_id",
+                                                                          "recieve_location": "receive_location"})])
+    elif args.from_snapshot:
+        import snapshots
+        version = None if args.from_snapshot == "latest" else args.from_snapshot
+        tables = snapshots.load_tables(version)
+        if "zones" in stages:
+            zone_cube = zones_stage(frames=[snapshots.load_frame("rallies", version)])
+        if "sequences" in stages:
+            import sequences
+            transitions = sequences.count_frames([snapshots.load_frame("rallies", version)])
+    else:
+        # the connections to the database, opened as the stages need them
+        open_connection = connection_factory(args.config)
+        if profile:
+            profiler = sql_profile.Profiler(explain=args.profile_explain)
+            open_connection = functools.partial(sql_profile.profiled_connection, open_connection, profiler)
+        connection_pool = pool.ConnectionPool(open_connection, args.connections)
+
+        if args.incremental:
+            with connection_pool.connection() as connection:
+                ingest_matches(connection, args.csv_paths)
+        else:
+            run_database_stages(connection_pool, args.csv_paths, stages, args.resume)
+
+        # the rest runs in order on one connection
+        connection = connection_pool.acquire()
+        cursor = connection.cursor()
+
+        if args.explain:
+            with sql_profile.stage(connection, "explain"):
+                clean_data.explain_aggregates(cursor)
+
+        if args.parity:
+            import local_backend
+            with sql_profile.stage(connection, "parity"):
+                local_backend.check_parity(cursor, args.csv_paths)
+
+        if "snapshot" in stages:
+            snapshot_stage(connection)
+
+        if "zones" in stages:
+            zone_cube = zones_stage(connection)
+
+        if "report" in stages:
+            tables = fetch_stage(connection)
+            transitions = fetch_transitions(connection)
+
+        if profile:
+            profiler.write_report()
+        connection_pool.close()
 
+    if "report" in stages:
+        render_stage(tables, args.use_cache, zone_cube, transitions, args.player_zones)
@@ -0,0 +1,64 @@
+# this file keeps a small pool of database connections, so statement groups
+# that do not depend on each other can run at the same time, each on its
+# own connection. connections are opened the first time they are needed and
+# reused after that, and at most size of them are open at once
+#
+#   pool = ConnectionPool(main.connection_factory(), size=4)
+#   with pool.connection() as connection:
+#       connection.cursor().execute(...)
+
+import queue
+import threading
+from contextlib import contextmanager
+
+
+class ConnectionPool:
+    def __init__(self, factory, size=4):
+        if size < 1:
+            raise ValueError("A connection pool needs at least one connection")
+        self.factory = factory
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.opened = []
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(size)
+
+    # a connection for the caller alone, waits while all size are in use
+    def acquire(self):
+        self.slots.acquire()
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            connection = self.factory()
+        except Exception:
+            self.slots.release()
+            raise
+        with self.lock:
+            self.opened.append(connection)
+        return connection
+
+    # hand a connection back. work that was not committed is rolled back,
+    # so the next user starts outside of a transaction
+    def release(self, connection):
+        try:
+            connection.rollback()
+        finally:
+            self.idle.put(connection)
+            self.slots.release()
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self):
+        with self.lock:
+            opened, self.opened = self.opened, []
+        for connection in opened:
+            connection.close()
+        self.idle = queue.LifoQueue()
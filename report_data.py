@@ -0,0 +1,256 @@
+# this file fetches the data the plots and scouting reports need.
+# the database does the summing and averaging, so only one row per player
+# and one row per team comes back, already in the right column types.
+# results are read through a server side cursor in batches of FETCH_SIZE
+# rows, so large results (like rallies) can be processed chunk by chunk
+
+import itertools
+
+import pandas as pd
+
+import clean_data
+import load_data
+
+# pandas dtype of each categorical column, the same values and order as
+# its enum type in the database
+CATEGORY_DTYPES = {col: pd.CategoricalDtype(values) for col, values in clean_data.ALLOWED_VALUES.items()}
+
+# team codes are not a fixed list, their categories are the codes in the data
+TEAM_DTYPE = "category"
+
+# rows per FETCH from a server side cursor
+FETCH_SIZE = 10000
+
+# player columns used by the plots and reports
+PLAYER_COLUMNS = {
+    "jersey_number": "Int64",
+    "team_name": TEAM_DTYPE,
+    "total_hits": "Int64",
+    "total_kills": "Int64",
+    "total_hit_errors": "Int64",
+    "hitting_efficiency": "float64",
+    **{f"pct_{ht}": "float64" for ht in clean_data.HIT_TYPES},
+}
+
+# team summary columns, player totals and averages plus the serving stats
+TEAM_COLUMNS = {
+    "team_name": TEAM_DTYPE,
+    "num_players": "Int64",
+    "total_hits": "Int64",
+    "total_kills": "Int64",
+    "total_hit_errors": "Int64",
+    "avg_hitting_efficiency": "float64",
+    "total_service_aces": "Int64",
+    "total_service_errors": "Int64",
+    "service_ace_ratio": "float64",
+    **{f"avg_pct_{ht}": "float64" for ht in clean_data.HIT_TYPES},
+}
+
+# rally columns, for consumers that work on every touch
+RALLY_COLUMNS = {
+    "match_id": "string",
+    "rally_id": "Int64",
+    "round": "Int64",
+    "team": TEAM_DTYPE,
+    "receive_location": "Int64",
+    "digger_location": "Int64",
+    "pass_land_location": "Int64",
+    "hitter_location": "Int64",
+    "hit_land_location": "Int64",
+    "pass_rating": CATEGORY_DTYPES["pass_rating"],
+    "set_location": "string",
+    "hit_type": CATEGORY_DTYPES["hit_type"],
+    "num_blockers": "Int64",
+    "block_touch": CATEGORY_DTYPES["block_touch"],
+    "serve_type": CATEGORY_DTYPES["serve_type"],
+    "win_reason": CATEGORY_DTYPES["win_reason"],
+    "lose_reason": CATEGORY_DTYPES["lose_reason"],
+    "winning_team": TEAM_DTYPE,
+}
+
+RALLY_QUERY = f"""
+    SELECT {", ".join(RALLY_COLUMNS)}
+    FROM rallies
+    ORDER BY id
+"""
+
+PLAYER_QUERY = f"""
+    SELECT jersey_number, team_name, total_hits, total_kills, total_hit_errors,
+        hitting_efficiency::float8,
+        {", ".join(f"pct_{ht}::float8" for ht in clean_data.HIT_TYPES)}
+    FROM player_stats
+    ORDER BY team_name, jersey_number
+"""
+
+TEAM_QUERY = f"""
+    SELECT p.team_name,
+        COUNT(*),
+        COALESCE(SUM(p.total_hits), 0),
+        COALESCE(SUM(p.total_kills), 0),
+        COALESCE(SUM(p.total_hit_errors), 0),
+        AVG(p.hitting_efficiency)::float8,
+        COALESCE(ts.total_service_aces, 0),
+        COALESCE(ts.total_service_errors, 0),
+        COALESCE(ts.service_ace_ratio, 0)::float8,
+        {", ".join(f"AVG(p.pct_{ht})::float8" for ht in clean_data.HIT_TYPES)}
+    FROM player_stats p
+    LEFT JOIN team_stats ts ON ts.team_name = p.team_name
+    WHERE p.team_name IS NOT NULL
+    GROUP BY p.team_name, ts.total_service_aces, ts.total_service_errors, ts.service_ace_ratio
+    ORDER BY p.team_name
+"""
+
+# the summary row of one team, the same columns as TEAM_QUERY. the serving
+# stats come from the team's own team_rallies partition, so the report of a
+# team only reads that team's rallies
+TEAM_SUMMARY_QUERY = f"""
+    SELECT p.team_name,
+        COUNT(*),
+        COALESCE(SUM(p.total_hits), 0),
+        COALESCE(SUM(p.total_kills), 0),
+        COALESCE(SUM(p.total_hit_errors), 0),
+        AVG(p.hitting_efficiency)::float8,
+        s.aces,
+        s.serve_errors,
+        CASE WHEN s.serve_errors > 0 THEN s.aces::NUMERIC / s.serve_errors ELSE 0 END::float8,
+        {", ".join(f"AVG(p.pct_{ht})::float8" for ht in clean_data.HIT_TYPES)}
+    FROM player_stats p
+    CROSS JOIN (
+        SELECT {clean_data.serve_counts()}
+        FROM team_rallies
+        WHERE team_name = %s
+    ) s
+    WHERE p.team_name = %s
+    GROUP BY p.team_name, s.aces, s.serve_errors
+"""
+
+
+# names for the server side cursors, unique within the session
+_cursor_names = (f"report_stream_{i}" for i in itertools.count(1))
+
+
+# run a query through a named server side cursor and yield the result in
+# frames of at most batch_size rows, each with the given column names and
+# types. only one batch is held client side at a time. the cursor lives in
+# the current transaction, so the connection must not commit in between
+def stream_frames(cursor, query, columns, args=(), batch_size=FETCH_SIZE):
+    name = next(_cursor_names)
+    cursor.execute(f"DECLARE {name} NO SCROLL CURSOR FOR {query}", args)
+    try:
+        while True:
+            cursor.execute(f"FETCH FORWARD {int(batch_size)} FROM {name}")
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            yield frame_from_rows(rows, columns)
+    finally:
+        cursor.execute(f"CLOSE {name}")
+
+
+# feed every chunk to each consumer, a callable that takes a frame
+def consume(chunks, *consumers):
+    for chunk in chunks:
+        for consumer in consumers:
+            consumer(chunk)
+
+
+# run a query and build a frame with the given column names and types
+def fetch_frame(cursor, query, columns, args=(), batch_size=FETCH_SIZE):
+    chunks = list(stream_frames(cursor, query, columns, args, batch_size))
+    if not chunks:
+        return frame_from_rows([], columns)
+    # chunks can have different team categories, which concat turns back
+    # into plain objects
+    return pd.concat(chunks, ignore_index=True).astype(columns)
+
+
+def frame_from_rows(rows, columns):
+    df = pd.DataFrame(list(rows), columns=list(columns), dtype=object)
+    return df.astype(columns)
+
+
+# every rally touch, in batches, for consumers that aggregate as they go
+def stream_rallies(cursor, batch_size=FETCH_SIZE):
+    return stream_frames(cursor, RALLY_QUERY, RALLY_COLUMNS, batch_size=batch_size)
+
+
+def fetch_players(cursor, batch_size=FETCH_SIZE):
+    return fetch_frame(cursor, PLAYER_QUERY, PLAYER_COLUMNS, batch_size=batch_size)
+
+
+def fetch_team_summaries(cursor, batch_size=FETCH_SIZE):
+    return fetch_frame(cursor, TEAM_QUERY, TEAM_COLUMNS, batch_size=batch_size)
+
+
+# the summary frame of one team, empty if it has no players
+def fetch_team_summary(cursor, team):
+    return fetch_frame(cursor, TEAM_SUMMARY_QUERY, TEAM_COLUMNS, args=(team, team))
+
+
+# the team summaries computed from a players frame and a team_stats frame,
+# the same way TEAM_QUERY does it. used by the pandas backend
+def team_summaries(df_players, df_team_stats):
+    totals = TeamTotals()
+    totals(df_players)
+    return totals.summaries(df_team_stats)
+
+
+# consumer that adds up player chunks per team, so the team summaries can be
+# built from a stream of players without keeping them. the averages are kept
+# as sums and counts of the non missing values until the end
+class TeamTotals:
+    SUM_COLUMNS = ["total_hits", "total_kills", "total_hit_errors"]
+    MEAN_COLUMNS = ["hitting_efficiency"] + [f"pct_{ht}" for ht in clean_data.HIT_TYPES]
+
+    def __init__(self):
+        self.totals = None
+
+    def __call__(self, chunk):
+        players = chunk[chunk["team_name"].notna()]
+        grouped = players.groupby("team_name", observed=True)
+        part = pd.concat([
+            grouped.size().rename("num_players"),
+            grouped[self.SUM_COLUMNS].sum(),
+            grouped[self.MEAN_COLUMNS].sum().add_prefix("sum_"),
+            grouped[self.MEAN_COLUMNS].count().add_prefix("count_"),
+        ], axis=1).astype("float64")
+        self.totals = part if self.totals is None else self.totals.add(part, fill_value=0)
+
+    def summaries(self, df_team_stats):
+        totals = self.totals if self.totals is not None else pd.DataFrame(
+            columns=["num_players"] + self.SUM_COLUMNS
+            + [f"{kind}_{col}" for kind in ("sum", "count") for col in self.MEAN_COLUMNS])
+        summary = totals[["num_players"] + self.SUM_COLUMNS].copy()
+        for col in self.MEAN_COLUMNS:
+            summary[f"avg_{col}"] = totals[f"sum_{col}"] / totals[f"count_{col}"].where(totals[f"count_{col}"] > 0)
+        summary = summary.rename_axis("team_name").reset_index()
+        summary["team_name"] = summary["team_name"].astype(TEAM_COLUMNS["team_name"])
+
+        serving = df_team_stats[["team_name", "total_service_aces", "total_service_errors", "service_ace_ratio"]]
+        summary = summary.merge(serving, on="team_name", how="left")
+        summary[["total_service_aces", "total_service_errors", "service_ace_ratio"]] = (
+            summary[["total_service_aces", "total_service_errors", "service_ace_ratio"]].fillna(0)
+        )
+        return summary[list(TEAM_COLUMNS)].astype(TEAM_COLUMNS).sort_values("team_name").reset_index(drop=True)
+
+
+# one summary frame per team code, for the given teams that have players
+def split_teams(df_teams, teams):
+    team_tables = {}
+    for team in teams:
+        df_team = df_teams[df_teams["team_name"] == team].reset_index(drop=True)
+        if not df_team.empty:
+            team_tables[team] = df_team
+    return team_tables
+
+
+# players and the summary frame of every team with a team_rallies
+# partition, one query per team
+def fetch_tables(cursor, batch_size=FETCH_SIZE):
+    df_players = fetch_players(cursor, batch_size)
+    team_tables = {}
+    for team in load_data.team_partitions(cursor):
+        df_team = fetch_team_summary(cursor, team)
+        if not df_team.empty:
+            team_tables[team] = df_team
+    return df_players, team_tables
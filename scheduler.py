@@ -0,0 +1,55 @@
+# this file runs named tasks on a thread pool in the order their
+# dependencies allow. a task starts as soon as every task it depends on has
+# finished, so tasks without a path between them run at the same time and
+# the wall time is that of the longest chain instead of the sum
+#
+#   run_tasks({"a": f, "b": g, "c": h}, {"c": ["a", "b"]})  # a and b together, then c
+
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+# every task that depends on stage, directly or through other tasks
+def dependents(dependencies, stage):
+    found = []
+    frontier = [stage]
+    while frontier:
+        current = frontier.pop()
+        for name, needs in dependencies.items():
+            if current in needs and name not in found:
+                found.append(name)
+                frontier.append(name)
+    return found
+
+
+# run every task once its dependencies are done and return the seconds each
+# one took. dependencies that are not in tasks count as done. when a task
+# fails, no new tasks start, the running ones finish and the error is raised
+def run_tasks(tasks, dependencies=None, workers=None):
+    dependencies = dependencies or {}
+    pending = dict(tasks)
+    done = set()
+    running = {}
+    timings = {}
+
+    def timed(name, task):
+        start = time.perf_counter()
+        task()
+        timings[name] = time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=workers or max(len(tasks), 1)) as executor:
+        while pending or running:
+            ready = [name for name in pending
+                     if all(need in done or need not in tasks for need in dependencies.get(name, ()))]
+            for name in ready:
+                running[executor.submit(timed, name, pending.pop(name))] = name
+            if not running:
+                raise ValueError(f"Circular dependencies between tasks: {', '.join(pending)}")
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                # raises the error of a failed task
+                future.result()
+                done.add(name)
+    return timings
@@ -0,0 +1,294 @@
+# this file models every rally as a sequence of rounds. the rounds of a
+# rally are one contiguous run of rows, and each touch is split into the
+# steps pass quality -> set -> hit type -> outcome, plus the step from a hit
+# to the opponent's pass in the next round. the transitions are counted per
+# team and per player (the passer for the pass, the hitter for the other
+# steps) with one np.bincount per step and chunk, stored in the
+# rally_transitions table and only added to as new matches are loaded.
+# TransitionCounts.matrix turns the counts into probabilities
+#
+#   counts.matrix("pass_to_set", "a")        # team a, pass rating x set
+#   counts.matrix("hit_to_outcome", "a", 15) # player 15 of team a
+
+import numpy as np
+import pandas as pd
+
+import clean_data
+import court_zones
+import report_data
+
+# the jersey of the rows that hold the counts of a whole team
+TEAM_JERSEY = -1
+
+OUTCOMES = court_zones.OUTCOMES
+
+# states of each step, in the order of the matrix rows and columns. set
+# locations are free text, their states are the values in the data
+STATE_ORDER = {
+    "pass_rating": clean_data.ALLOWED_VALUES["pass_rating"],
+    "set_location": None,
+    "hit_type": clean_data.HIT_TYPES,
+    "outcome": OUTCOMES,
+}
+
+# every transition and the states it goes from and to. hit_to_next_pass
+# is the pass rating the other team got off the hit, one round later
+TRANSITIONS = {
+    "pass_to_set": ("pass_rating", "set_location"),
+    "set_to_hit": ("set_location", "hit_type"),
+    "hit_to_outcome": ("hit_type", "outcome"),
+    "hit_to_next_pass": ("hit_type", "pass_rating"),
+}
+
+# the player each transition is counted for: the passer for the pass and
+# the hitter for the rest. the passer is the receiver of the round
+TRANSITION_PLAYERS = {
+    "pass_to_set": "receive_location",
+    "set_to_hit": "hitter_location",
+    "hit_to_outcome": "hitter_location",
+    "hit_to_next_pass": "hitter_location",
+}
+
+COUNT_COLUMNS = ["team", "jersey", "transition", "from_state", "to_state", "count"]
+
+NEW_RALLIES_QUERY = f"""
+    SELECT {", ".join(report_data.RALLY_COLUMNS)}
+    FROM rallies
+    WHERE match_id = ANY(%s)
+    ORDER BY id
+"""
+
+
+# the rounds of a rally are consecutive rows in load order. rally numbers
+# start over in every set, so a rally ends where the match or rally number
+# changes or the round does not go up. returns the rows and the position
+# where each rally starts, rally i is rows starts[i]:starts[i + 1]
+def group_rallies(chunk):
+    chunk = chunk.reset_index(drop=True)
+    match = chunk["match_id"].to_numpy(dtype=object)
+    rally = chunk["rally_id"].to_numpy(dtype=np.int64, na_value=-1)
+    rounds = chunk["round"].to_numpy(dtype=np.int64, na_value=-1)
+    changes = (match[1:] != match[:-1]) | (rally[1:] != rally[:-1]) | (rounds[1:] <= rounds[:-1])
+    starts = np.concatenate([[0], np.flatnonzero(changes) + 1]) if len(chunk) else np.zeros(0, dtype=np.int64)
+    return chunk, starts
+
+
+# for every row, whether the next row is the next round of the same rally
+def next_round_mask(chunk, starts):
+    same_rally = np.ones(len(chunk), dtype=bool)
+    same_rally[starts - 1] = False
+    rounds = chunk["round"].to_numpy(dtype=np.int64, na_value=-1)
+    next_round = np.zeros(len(chunk), dtype=bool)
+    next_round[:-1] = rounds[1:] == rounds[:-1] + 1
+    return same_rally & next_round
+
+
+# state codes of one column, -1 where it is missing, and their labels
+def state_codes(values, state):
+    if STATE_ORDER[state] is None:
+        codes, labels = pd.factorize(values.astype(object), sort=True)
+        return codes.astype(np.int64), list(labels)
+    return pd.Categorical(values, categories=STATE_ORDER[state]).codes.astype(np.int64), STATE_ORDER[state]
+
+
+# a group per team and player of column, the touches without a player only
+# count for the team and the touches without a team are left out (-1).
+# returns the group of every row, the teams, the team of every group and
+# the jersey of every group
+def player_groups(chunk, column):
+    has_team = chunk["team"].notna().to_numpy(dtype=bool)
+    jerseys = chunk[column].to_numpy(dtype=np.int64, na_value=TEAM_JERSEY)
+    keys = pd.MultiIndex.from_arrays([chunk["team"].astype(object)[has_team], jerseys[has_team]])
+    group = np.full(len(chunk), -1, dtype=np.int64)
+    group[has_team], group_keys = keys.factorize()
+    group_teams, team_of_group = np.unique(np.array([key[0] for key in group_keys], dtype=object),
+                                           return_inverse=True)
+    group_jerseys = np.array([key[1] for key in group_keys], dtype=np.int64)
+    return group, group_teams, team_of_group, group_jerseys
+
+
+# the transition counts of whole rallies, one row per team or player,
+# transition and pair of states
+def count_transitions(chunk):
+    if chunk.empty:
+        return pd.DataFrame(columns=COUNT_COLUMNS)
+    chunk, starts = group_rallies(chunk)
+
+    outcome = chunk["win_reason"].astype(object).where(chunk["win_reason"].notna(), "in_play")
+    states = {state: state_codes(chunk[state] if state != "outcome" else outcome, state) for state in STATE_ORDER}
+    # the pass rating of the next round, for hit_to_next_pass
+    next_pass = np.full(len(chunk), -1, dtype=np.int64)
+    follows = next_round_mask(chunk, starts)
+    next_pass[:-1][follows[:-1]] = states["pass_rating"][0][1:][follows[:-1]]
+    groups = {column: player_groups(chunk, column) for column in set(TRANSITION_PLAYERS.values())}
+
+    parts = []
+    for transition, (from_state, to_state) in TRANSITIONS.items():
+        group, group_teams, team_of_group, group_jerseys = groups[TRANSITION_PLAYERS[transition]]
+        from_codes, from_labels = states[from_state]
+        to_codes, to_labels = states[to_state]
+        if transition == "hit_to_next_pass":
+            to_codes = next_pass
+        valid = (group >= 0) & (from_codes >= 0) & (to_codes >= 0)
+        shape = (len(group_jerseys), len(from_labels), len(to_labels))
+        packed = (group[valid] * shape[1] + from_codes[valid]) * shape[2] + to_codes[valid]
+        counts = np.bincount(packed, minlength=int(np.prod(shape))).reshape(shape)
+
+        team_counts = np.zeros((len(group_teams),) + shape[1:], dtype=np.int64)
+        np.add.at(team_counts, team_of_group, counts)
+        players = group_jerseys != TEAM_JERSEY
+
+        for teams, team_jerseys, matrix in [(group_teams, np.full(len(group_teams), TEAM_JERSEY), team_counts),
+                                            (group_teams[team_of_group[players]], group_jerseys[players],
+                                             counts[players])]:
+            g, f, t = np.nonzero(matrix)
+            parts.append(pd.DataFrame({
+                "team": teams[g],
+                "jersey": team_jerseys[g],
+                "transition": transition,
+                "from_state": np.asarray(from_labels, dtype=object)[f],
+                "to_state": np.asarray(to_labels, dtype=object)[t],
+                "count": matrix[g, f, t],
+            }))
+    return pd.concat(parts, ignore_index=True)
+
+
+# sum count frames that can have the same keys
+def combine_counts(frames):
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame(columns=COUNT_COLUMNS)
+    combined = pd.concat(frames, ignore_index=True)
+    return combined.groupby(COUNT_COLUMNS[:-1], as_index=False, sort=True)["count"].sum()
+
+
+class TransitionCounts:
+    def __init__(self, counts):
+        self.counts = counts.astype({"jersey": np.int64, "count": np.int64})
+
+    def teams(self):
+        return sorted(self.counts["team"].unique())
+
+    # the transition counts of a team, or of one player with a jersey, as a
+    # from state x to state frame, with the probabilities of each row when
+    # normalize is set
+    def matrix(self, transition, team, jersey=TEAM_JERSEY, normalize=True):
+        rows = self.counts[(self.counts["transition"] == transition) & (self.counts["team"] == team)
+                           & (self.counts["jersey"] == jersey)]
+        from_state, to_state = TRANSITIONS[transition]
+        matrix = rows.pivot_table(index="from_state", columns="to_state", values="count",
+                                  aggfunc="sum", fill_value=0)
+        matrix = matrix.reindex(index=STATE_ORDER[from_state] or sorted(matrix.index),
+                                columns=STATE_ORDER[to_state] or sorted(matrix.columns), fill_value=0)
+        matrix = matrix.rename_axis(index=from_state, columns=to_state)
+        if not normalize:
+            return matrix
+        totals = matrix.sum(axis=1)
+        return matrix.div(totals.where(totals > 0), axis=0).fillna(0.0)
+
+    # every transition matrix of a team, by transition name
+    def team_matrices(self, team):
+        return {transition: self.matrix(transition, team) for transition in TRANSITIONS}
+
+
+# consumer that counts the transitions of chunks of rallies, see
+# report_data.consume. the rows of the last rally of a chunk are held back
+# until the next one, so a rally split between two fetches is counted whole
+class TransitionCounter:
+    def __init__(self):
+        self.parts = []
+        self.tail = None
+
+    def __call__(self, chunk):
+        if self.tail is not None:
+            chunk = pd.concat([self.tail, chunk], ignore_index=True)
+        if chunk.empty:
+            return
+        chunk, starts = group_rallies(chunk)
+        self.tail = chunk.iloc[starts[-1]:]
+        if starts[-1] > 0:
+            self.parts.append(count_transitions(chunk.iloc[:starts[-1]]))
+
+    def counts(self):
+        if self.tail is not None:
+            self.parts.append(count_transitions(self.tail))
+            self.tail = None
+        self.parts = [combine_counts(self.parts)]
+        return TransitionCounts(self.parts[0])
+
+
+# count the transitions of an iterable of rally frames in one pass
+def count_frames(frames):
+    counter = TransitionCounter()
+    for frame in frames:
+        counter(frame)
+    return counter.counts()
+
+
+def create_transition_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS rally_transitions (
+            team TEXT NOT NULL,
+            jersey INTEGER NOT NULL,
+            transition TEXT NOT NULL,
+            from_state TEXT NOT NULL,
+            to_state TEXT NOT NULL,
+            count BIGINT NOT NULL,
+            PRIMARY KEY (team, jersey, transition, from_state, to_state)
+        )
+    """)
+    # the matches whose rallies are already in rally_transitions
+    cursor.execute("CREATE TABLE IF NOT EXISTS transition_matches (match_id TEXT PRIMARY KEY)")
+
+
+# forget the stored counts, so the next update counts every match again
+def clear_transitions(cursor):
+    create_transition_tables(cursor)
+    cursor.execute("TRUNCATE rally_transitions, transition_matches")
+
+
+# matches in rallies that were not counted yet
+def uncounted_matches(cursor):
+    cursor.execute("""
+        SELECT DISTINCT match_id FROM rallies
+        WHERE match_id IS NOT NULL
+            AND match_id NOT IN (SELECT match_id FROM transition_matches)
+        ORDER BY match_id
+    """)
+    return [row[0] for row in cursor.fetchall()]
+
+
+# add counts to the stored ones, as a single insert of column arrays
+def add_counts(cursor, counts):
+    frame = counts.counts
+    if frame.empty:
+        return
+    cursor.execute("""
+        INSERT INTO rally_transitions (team, jersey, transition, from_state, to_state, count)
+        SELECT * FROM unnest(%s::text[], %s::int[], %s::text[], %s::text[], %s::text[], %s::bigint[])
+        ON CONFLICT (team, jersey, transition, from_state, to_state) DO UPDATE
+        SET count = rally_transitions.count + EXCLUDED.count
+    """, tuple(frame[col].tolist() for col in COUNT_COLUMNS))
+
+
+# count the rallies of the matches that are not in rally_transitions yet and
+# add them to it. returns the matches that were added
+def update_transitions(cursor, batch_size=report_data.FETCH_SIZE):
+    create_transition_tables(cursor)
+    match_ids = uncounted_matches(cursor)
+    if not match_ids:
+        return []
+    frames = report_data.stream_frames(cursor, NEW_RALLIES_QUERY, report_data.RALLY_COLUMNS,
+                                       args=(match_ids,), batch_size=batch_size)
+    add_counts(cursor, count_frames(frames))
+    cursor.execute("INSERT INTO transition_matches (match_id) SELECT unnest(%s::text[])", (match_ids,))
+    return match_ids
+
+
+# the stored counts, or None before the sequences stage ran
+def load_counts(cursor):
+    cursor.execute("SELECT to_regclass('rally_transitions') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        return None
+    cursor.execute(f"SELECT {', '.join(COUNT_COLUMNS)} FROM rally_transitions")
+    return TransitionCounts(pd.DataFrame(cursor.fetchall(), columns=COUNT_COLUMNS))
@@ -0,0 +1,157 @@
+# this file writes versioned, columnar snapshots of the derived tables after
+# the aggregate stage, and loads them back without the database. each
+# snapshot is a directory under snapshots/ with one Arrow IPC file per table
+# and a manifest.json. the files are uncompressed, so they are memory mapped
+# when they are read and the Arrow tables do not copy the data
+#
+#   snapshots/20261018T090000Z/rallies.arrow
+#   snapshots/20261018T090000Z/players.arrow
+#   snapshots/20261018T090000Z/team_summaries.arrow
+#   snapshots/20261018T090000Z/manifest.json
+#   snapshots/LATEST
+
+import json
+import os
+from datetime import datetime, timezone
+
+import pyarrow as pa
+
+import clean_data
+import load_data
+import report_data
+
+SNAPSHOT_DIR = "snapshots"
+
+# the frames of a snapshot and the column types they are loaded back with
+SNAPSHOT_TABLES = {
+    "rallies": report_data.RALLY_COLUMNS,
+    "players": report_data.PLAYER_COLUMNS,
+    "team_summaries": report_data.TEAM_COLUMNS,
+}
+
+
+def table_path(version_dir, name):
+    return os.path.join(version_dir, f"{name}.arrow")
+
+
+# a new snapshot directory named after the current time
+def new_version_dir(snapshot_dir=SNAPSHOT_DIR):
+    version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    version_dir = os.path.join(snapshot_dir, version)
+    suffix = 1
+    while os.path.exists(version_dir):
+        suffix += 1
+        version_dir = os.path.join(snapshot_dir, f"{version}_{suffix}")
+    os.makedirs(version_dir)
+    return version_dir
+
+
+# team codes have no fixed categories, so every chunk has its own. an IPC
+# file keeps one dictionary per column, so they are written as strings and
+# turned back into categories on load
+def arrow_chunk(chunk):
+    chunk = chunk.copy()
+    for col in chunk.columns:
+        if str(chunk[col].dtype) == "category" and col not in report_data.CATEGORY_DTYPES:
+            chunk[col] = chunk[col].astype(object)
+    return pa.Table.from_pandas(chunk, preserve_index=False)
+
+
+# write frames to one IPC file, a batch at a time, and return the row count
+def write_frames(path, frames):
+    rows = 0
+    writer = None
+    try:
+        for frame in frames:
+            table = arrow_chunk(frame)
+            if writer is None:
+                writer = pa.ipc.new_file(path, table.schema)
+            writer.write_table(table)
+            rows += table.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+# write a snapshot of rallies, the player statistics and the team summaries.
+# rallies are streamed from a server side cursor, so it never sits in memory
+def export_snapshot(cursor, snapshot_dir=SNAPSHOT_DIR, batch_size=report_data.FETCH_SIZE):
+    version_dir = new_version_dir(snapshot_dir)
+    sources = {
+        "rallies": report_data.stream_rallies(cursor, batch_size),
+        "players": [report_data.fetch_players(cursor, batch_size)],
+        "team_summaries": [report_data.fetch_team_summaries(cursor, batch_size)],
+    }
+
+    manifest = {
+        "version": os.path.basename(version_dir),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "teams": load_data.team_partitions(cursor),
+        "hit_types": clean_data.HIT_TYPES,
+        "tables": {},
+    }
+    for name, frames in sources.items():
+        path = table_path(version_dir, name)
+        rows = write_frames(path, frames)
+        if not rows:
+            # an empty table still gets a file with the right columns
+            write_frames(path, [report_data.frame_from_rows([], SNAPSHOT_TABLES[name])])
+        manifest["tables"][name] = {"file": os.path.basename(path), "rows": rows}
+
+    with open(os.path.join(version_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    # point LATEST at the new snapshot only once it is complete
+    with open(os.path.join(snapshot_dir, "LATEST"), "w") as f:
+        f.write(manifest["version"])
+
+    print(f"Snapshot saved as {version_dir}")
+    return version_dir
+
+
+# snapshot versions, oldest first
+def list_versions(snapshot_dir=SNAPSHOT_DIR):
+    if not os.path.isdir(snapshot_dir):
+        return []
+    return sorted(entry for entry in os.listdir(snapshot_dir)
+                  if os.path.exists(os.path.join(snapshot_dir, entry, "manifest.json")))
+
+
+def version_dir_for(version=None, snapshot_dir=SNAPSHOT_DIR):
+    if version is None:
+        latest = os.path.join(snapshot_dir, "LATEST")
+        if not os.path.exists(latest):
+            raise FileNotFoundError(f"No snapshot in {snapshot_dir}, run the snapshot stage first")
+        with open(latest) as f:
+            version = f.read().strip()
+    version_dir = os.path.join(snapshot_dir, version)
+    if not os.path.exists(os.path.join(version_dir, "manifest.json")):
+        raise FileNotFoundError(f"Snapshot {version} not found in {snapshot_dir}")
+    return version_dir
+
+
+def load_manifest(version=None, snapshot_dir=SNAPSHOT_DIR):
+    with open(os.path.join(version_dir_for(version, snapshot_dir), "manifest.json")) as f:
+        return json.load(f)
+
+
+# one table of a snapshot as an Arrow table over the memory mapped file,
+# for ad-hoc analysis without copying it
+def load_arrow(name, version=None, snapshot_dir=SNAPSHOT_DIR):
+    path = table_path(version_dir_for(version, snapshot_dir), name)
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+# one table of a snapshot as a frame with the report column types
+def load_frame(name, version=None, snapshot_dir=SNAPSHOT_DIR):
+    columns = SNAPSHOT_TABLES[name]
+    return load_arrow(name, version, snapshot_dir).to_pandas()[list(columns)].astype(columns)
+
+
+# the same frames as report_data.fetch_tables, from a snapshot
+def load_tables(version=None, snapshot_dir=SNAPSHOT_DIR):
+    manifest = load_manifest(version, snapshot_dir)
+    df_players = load_frame("players", manifest["version"], snapshot_dir)
+    df_teams = load_frame("team_summaries", manifest["version"], snapshot_dir)
+    return df_players, report_data.split_teams(df_teams, manifest["teams"])
@@ -0,0 +1,167 @@
+# this file wraps a pg8000 connection so that every statement the pipeline
+# runs is recorded with the stage that issued it, its wall time, the rows it
+# affected and, optionally, its EXPLAIN (ANALYZE, BUFFERS) plan. at the end
+# of a run write_report ranks the statements by time spent
+
+import re
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# statements that EXPLAIN accepts
+EXPLAINABLE = ("select", "insert", "update", "delete", "with")
+
+
+class Profiler:
+    def __init__(self, explain=False):
+        self.explain = explain
+        self.records = []
+        # stages run in parallel on several threads, each one tags its own
+        self.local = threading.local()
+
+    @property
+    def current_stage(self):
+        return getattr(self.local, "stage", "setup")
+
+    @current_stage.setter
+    def current_stage(self, name):
+        self.local.stage = name
+
+    # tag every statement run inside the block with the stage name
+    @contextmanager
+    def stage(self, name):
+        previous = self.current_stage
+        self.current_stage = name
+        try:
+            yield
+        finally:
+            self.current_stage = previous
+
+    def record(self, statement, seconds, rows, plan=None):
+        self.records.append({
+            "stage": self.current_stage,
+            "statement": statement,
+            "seconds": seconds,
+            "rows": rows,
+            "plan": plan,
+        })
+
+    # statements grouped by stage and text, slowest first
+    def ranked(self):
+        groups = {}
+        for record in self.records:
+            key = (record["stage"], statement_text(record["statement"]))
+            group = groups.setdefault(key, {"stage": key[0], "statement": key[1], "seconds": 0.0,
+                                            "calls": 0, "rows": 0, "plan": None, "slowest": 0.0})
+            group["seconds"] += record["seconds"]
+            group["calls"] += 1
+            group["rows"] += max(record["rows"], 0)
+            # keep the plan of the slowest call
+            if record["plan"] and record["seconds"] >= group["slowest"]:
+                group["plan"] = record["plan"]
+                group["slowest"] = record["seconds"]
+        return sorted(groups.values(), key=lambda group: group["seconds"], reverse=True)
+
+    def write_report(self, path="profile_report.txt", top=20):
+        ranked = self.ranked()
+        total = sum(group["seconds"] for group in ranked) or 1e-9
+
+        stage_totals = {}
+        for group in ranked:
+            stage_totals[group["stage"]] = stage_totals.get(group["stage"], 0.0) + group["seconds"]
+
+        with open(path, "w") as f:
+            f.write("SQL Profile\n")
+            f.write("=" * 50 + "\n\n")
+            f.write(f"Statements executed: {len(self.records)}\n")
+            f.write(f"Total SQL time: {total:.3f}s\n\n")
+
+            f.write("Time per stage:\n")
+            for stage, seconds in sorted(stage_totals.items(), key=lambda item: item[1], reverse=True):
+                f.write(f"  {stage:<12} {seconds:9.3f}s  {seconds / total:6.1%}\n")
+            f.write("\n")
+
+            f.write("Slowest statements:\n")
+            for rank, group in enumerate(ranked[:top], start=1):
+                f.write(f"{rank:>3}. [{group['stage']}] {group['seconds']:.3f}s ({group['seconds'] / total:.1%}), "
+                        f"{group['calls']} call(s), {group['rows']} row(s)\n")
+                f.write(f"     {group['statement'][:200]}\n")
+                if group["plan"]:
+                    for line in group["plan"].splitlines():
+                        f.write(f"       {line}\n")
+                f.write("\n")
+
+        print(f"SQL profile saved as {path}")
+        return path
+
+
+class ProfilingCursor:
+    def __init__(self, cursor, profiler):
+        self._cursor = cursor
+        self._profiler = profiler
+
+    def execute(self, operation, args=(), stream=None):
+        plan = None
+        if self._profiler.explain and stream is None and is_explainable(operation):
+            plan = self.explain_analyze(operation, args)
+
+        start = time.perf_counter()
+        self._cursor.execute(operation, args, stream=stream)
+        seconds = time.perf_counter() - start
+
+        self._profiler.record(operation, seconds, self._cursor.rowcount, plan)
+        return self
+
+    # run EXPLAIN (ANALYZE, BUFFERS) inside a savepoint and roll it back, so
+    # the statement's changes are only applied once, by the real execute
+    def explain_analyze(self, operation, args):
+        self._cursor.execute("SAVEPOINT profile_explain")
+        try:
+            self._cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + operation, args)
+            plan = "\n".join(row[0] for row in self._cursor.fetchall())
+        except Exception as e:
+            plan = f"EXPLAIN failed: {e}"
+        self._cursor.execute("ROLLBACK TO SAVEPOINT profile_explain")
+        self._cursor.execute("RELEASE SAVEPOINT profile_explain")
+        return plan
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+class ProfilingConnection:
+    def __init__(self, connection, profiler):
+        self._connection = connection
+        self.profiler = profiler
+
+    def cursor(self):
+        return ProfilingCursor(self._connection.cursor(), self.profiler)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+# a new profiled connection from a function that opens plain ones
+def profiled_connection(open_connection, profiler):
+    return ProfilingConnection(open_connection(), profiler)
+
+
+# stage block for a connection that may or may not be profiled
+def stage(connection, name):
+    if isinstance(connection, ProfilingConnection):
+        return connection.profiler.stage(name)
+    return nullcontext()
+
+
+# single line version of a statement, for grouping and for the report
+def statement_text(statement):
+    return re.sub(r"\s+", " ", statement).strip()
+
+
+def is_explainable(statement):
+    text = statement_text(statement).lower()
+    # a string with several statements cannot be explained as one
+    return text.startswith(EXPLAINABLE) and ";" not in text.rstrip(";")
@@ -0,0 +1,157 @@
+# the pandas backend has to build the same tables as a full database run.
+# the database is a pgserver instance when pgserver is installed, otherwise
+# the server of the PG* variables. the run happens in a scratch database
+# that is dropped afterwards, so the tables of a real database stay as they
+# are. without either the tests are skipped
+
+import functools
+import os
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import local_backend
+import main
+import pool
+
+DATASET = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dataset_full.csv")
+SCRATCH_DATABASE = "volleyball_parity_test"
+ROWS = 300
+# first data row of each match of the incremental run. the matches overlap,
+# so their players, including one without a valid team, recur
+MATCH_STARTS = [0, 100, 200]
+
+
+# host, port, user and password of a server to test against
+@pytest.fixture(scope="module")
+def server_settings(tmp_path_factory):
+    try:
+        import pgserver
+    except ImportError:
+        pgserver = None
+
+    if pgserver is not None:
+        server = pgserver.get_server(tmp_path_factory.mktemp("pgdata"), cleanup_mode="stop")
+        uri = urlsplit(server.get_uri())
+        yield {"host": parse_qs(uri.query)["host"][0], "port": uri.port, "user": uri.username,
+               "password": uri.password}
+        server.cleanup()
+    elif any(var in os.environ for var in main.ENV_SETTINGS.values()):
+        yield {key: os.environ.get(var) for key, var in main.ENV_SETTINGS.items()}
+    else:
+        pytest.skip("no database: install pgserver or set the PG* variables")
+
+
+# a function that opens a connection to an empty scratch database
+@pytest.fixture(scope="module")
+def open_connection(server_settings):
+    admin = main.connect_with(server_settings)
+    admin.autocommit = True
+    admin.cursor().execute(f"DROP DATABASE IF EXISTS {SCRATCH_DATABASE}")
+    admin.cursor().execute(f"CREATE DATABASE {SCRATCH_DATABASE}")
+    yield functools.partial(main.connect_with, {**server_settings, "database": SCRATCH_DATABASE})
+    admin.cursor().execute(f"DROP DATABASE IF EXISTS {SCRATCH_DATABASE}")
+    admin.close()
+
+
+# the first rows of the dataset as a match of its own
+@pytest.fixture(scope="module")
+def csv_path(tmp_path_factory):
+    path = tmp_path_factory.mktemp("matches") / "parity_match.csv"
+    with open(DATASET) as source, open(path, "w") as target:
+        for _, line in zip(range(ROWS + 1), source):
+            target.write(line)
+    return str(path)
+
+
+# overlapping stretches of the dataset as matches of their own
+@pytest.fixture(scope="module")
+def match_paths(tmp_path_factory):
+    with open(DATASET) as source:
+        header = next(source)
+        rows = [line for _, line in zip(range(MATCH_STARTS[-1] + ROWS), source)]
+    match_dir = tmp_path_factory.mktemp("incremental")
+    paths = []
+    for i, start in enumerate(MATCH_STARTS):
+        path = match_dir / f"match_{i + 1:05d}.csv"
+        path.write_text(header + "".join(rows[start:start + ROWS]))
+        paths.append(str(path))
+    return paths
+
+
+# the tables of a full database run and of the pandas backend, both as
+# (players, {team: summary})
+@pytest.fixture(scope="module")
+def tables(open_connection, csv_path):
+    connection_pool = pool.ConnectionPool(open_connection)
+    try:
+        main.full_rebuild(connection_pool, [csv_path])
+        with connection_pool.connection() as connection:
+            db_tables = main.fetch_stage(connection)
+    finally:
+        connection_pool.close()
+    return local_backend.build_tables([csv_path]), db_tables
+
+
+# a frame in a form both backends agree on: the columns of the database
+# frame without player ids, the rows sorted by key, the key columns as
+# text and the rest as floats
+def comparable(frame, columns, key):
+    frame = frame[columns].sort_values(key).reset_index(drop=True)
+    for col in columns:
+        if col in key:
+            frame[col] = frame[col].astype("string")
+        else:
+            frame[col] = pd.to_numeric(frame[col], errors="coerce").astype(float)
+    return frame
+
+
+def assert_same_table(local, db, key):
+    columns = [col for col in db.columns if col != "player_id"]
+    pd.testing.assert_frame_equal(comparable(local, columns, key), comparable(db, columns, key),
+                                  check_dtype=False, rtol=1e-9)
+
+
+def test_same_teams(tables):
+    (_, local_teams), (_, db_teams) = tables
+    assert sorted(local_teams) == sorted(db_teams)
+    assert len(db_teams) > 0
+
+
+def test_players_match(tables):
+    (local_players, _), (db_players, _) = tables
+    assert len(db_players) > 0
+    assert_same_table(local_players, db_players, ["team_name", "jersey_number"])
+    assert np.isfinite(db_players["hitting_efficiency"].astype(float)).any()
+
+
+def test_team_summaries_match(tables):
+    (_, local_teams), (_, db_teams) = tables
+    for team in db_teams:
+        assert_same_table(local_teams[team], db_teams[team], ["team_name"])
+
+
+def test_parity_rejects_incremental():
+    with pytest.raises(SystemExit):
+        main.parse_args(["--parity", "--incremental"])
+
+
+# a full run on the first match and an ingest of the others has to end up
+# with the same tables as the pandas backend on all of them
+def test_incremental_ingest_matches(open_connection, match_paths):
+    connection_pool = pool.ConnectionPool(open_connection)
+    try:
+        main.full_rebuild(connection_pool, match_paths[:1])
+        with connection_pool.connection() as connection:
+            main.ingest_matches(connection, match_paths[1:])
+            db_players, db_teams = main.fetch_stage(connection)
+    finally:
+        connection_pool.close()
+    local_players, local_teams = local_backend.build_tables(match_paths)
+
+    assert_same_table(local_players, db_players, ["team_name", "jersey_number"])
+    assert sorted(local_teams) == sorted(db_teams)
+    for team in db_teams:
+        assert_same_table(local_teams[team], db_teams[team], ["team_name"])
@@ -1,175 +1,305 @@
 # create the visualizations and summaries to be used in player and team scouting report
 
-import matplotlib.pyplot as plt
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import pandas as pd
 import seaborn as sns
-import os
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.colors import to_rgba_array
+from matplotlib.figure import Figure
+from matplotlib.lines import Line2D
+
+import bootstrap
 
-# create a directory within the project to save the plots
+# directory within the project to save the plots, created when the
+# plots are generated
 PLOTS_DIR = "plots"
-os.makedirs(PLOTS_DIR, exist_ok=True)
+
+# maps each render job to the cache key and file of its last render
+RENDER_CACHE = os.path.join(PLOTS_DIR, ".render_cache.json")
+
+# source files of the code the render jobs run or get their inputs from
+RENDER_MODULES = ["visualize.py", "bootstrap.py", "court_zones.py", "sequences.py"]
 
 # create a directory to store the teams scouting report and plots
-def create_team_dir(team):
-    team_dir = os.path.join(PLOTS_DIR, f"team{team.upper()}")
+def create_team_dir(team, plots_dir=PLOTS_DIR):
+    team_dir = os.path.join(plots_dir, f"team{team.upper()}")
     os.makedirs(team_dir, exist_ok=True)
     return team_dir
 
-# load the tables from the database into dataframes
-def fetch_tables(cursor):
-    df_players = pd.read_sql("SELECT * FROM players;", cursor.connection)
-    df_team_a = pd.read_sql("SELECT * FROM team_a;", cursor.connection)
-    df_team_b = pd.read_sql("SELECT * FROM team_b;", cursor.connection)
-    
-    return df_players, df_team_a, df_team_b
+# label the radial axis in percent, fixing the ticks first so the labels
+# stay on the ticks they were made for
+def set_percent_labels(ax):
+    ticks = ax.get_yticks()
+    ax.set_yticks(ticks)
+    ax.set_yticklabels([f"{int(x*100)}%" for x in ticks])
+
+# players x hit types matrix of percentages, missing values as 0
+def hit_type_matrix(df, hit_types, prefix='pct_'):
+    return df[[f'{prefix}{ht}' for ht in hit_types]].to_numpy(dtype=float, na_value=0.0)
 
 def player_radial_plot_hit_types(df_players_team, team, team_dir):
     hit_types = ['tip', 'roll_shot', 'free_ball', 'off_speed', 'hit', 'overpass', 'blocked']
-    df_team = df_players_team.copy()
     
     N = len(hit_types)
-    angles = np.linspace(0, 2 * np.pi, N, endpoint=False).tolist()
-    angles += angles[:1]  
-    
-    plt.figure(figsize=(6,6))
-    ax = plt.subplot(111, polar=True)
+    angles = np.linspace(0, 2 * np.pi, N, endpoint=False)
+    angles = np.append(angles, angles[0])
+
+    # one closed polygon per player, built from the whole matrix at once
+    values = hit_type_matrix(df_players_team, hit_types)
+    values = np.hstack([values, values[:, :1]])
+    polygons = np.stack([np.broadcast_to(angles, values.shape), values], axis=-1)
+    colors = to_rgba_array([f"C{i % 10}" for i in range(len(values))])
     
-    for _, player in df_team.iterrows():
-        values = [player[f'pct_{ht}'] if player[f'pct_{ht}'] is not None else 0 for ht in hit_types]
-        values += values[:1]
-        ax.plot(angles, values, label=f"Player {player['jersey_number']}")
-        ax.fill(angles, values, alpha=0.1)
+    fig = Figure(figsize=(6,6))
+    ax = fig.add_subplot(111, polar=True)
+
+    # all outlines and all fills are drawn as two collections
+    fills = colors.copy()
+    fills[:, 3] = 0.1
+    ax.add_collection(PolyCollection(polygons, facecolors=fills, edgecolors='none'))
+    ax.add_collection(LineCollection(polygons, colors=colors))
+    ax.set_ylim(0, max(values.max(initial=0), 0.1) * 1.05)
     
     ax.set_xticks(angles[:-1])
     ax.set_xticklabels(hit_types)
-    ax.set_yticklabels([f"{int(x*100)}%" for x in ax.get_yticks()])
-    plt.title(f"Hit Type Percentages - Team {team.upper()}")
-    plt.legend(loc='upper right', bbox_to_anchor=(1.3, 1.1))
+    set_percent_labels(ax)
+    ax.set_title(f"Hit Type Percentages - Team {team.upper()}")
+    labels = "Player " + df_players_team['jersey_number'].astype(str)
+    handles = [Line2D([], [], color=color) for color in colors]
+    ax.legend(handles, labels.tolist(), loc='upper right', bbox_to_anchor=(1.3, 1.1))
     
     filename = os.path.join(team_dir, f"hit_types_team{team.upper()}.png")
-    plt.savefig(filename, bbox_inches='tight')
-    plt.close()
+    fig.savefig(filename, bbox_inches='tight')
     print(f"Radar plot saved as {filename}")
+    return filename
 
-def team_radial_plot_hit_types(df_team, team):
+def team_radial_plot_hit_types(df_team, team, plots_dir=PLOTS_DIR):
     hit_types = ['tip', 'roll_shot', 'free_ball', 'off_speed', 'hit', 'overpass', 'blocked']
-    df = df_team.copy()
     
-    # team average hit percentage
-    team_avg = df[[f'pct_{ht}' for ht in hit_types]].mean().fillna(0).tolist()
+    # team average hit percentage, from the team summary row
+    team_avg = hit_type_matrix(df_team, hit_types, prefix='avg_pct_')[0].tolist()
     team_avg += team_avg[:1]  
     
     N = len(hit_types)
     angles = np.linspace(0, 2*np.pi, N, endpoint=False).tolist()
     angles += angles[:1]
     
-    plt.figure(figsize=(6,6))
-    ax = plt.subplot(111, polar=True)
+    fig = Figure(figsize=(6,6))
+    ax = fig.add_subplot(111, polar=True)
     ax.plot(angles, team_avg, label=f"Team {team.upper()}", color='red')
     ax.fill(angles, team_avg, alpha=0.2, color='red')
+
+    # bootstrap interval of every average, when the row has one
+    if f'avg_pct_{hit_types[0]}_low' in df_team.columns:
+        low = hit_type_matrix(df_team, [f'{ht}_low' for ht in hit_types], prefix='avg_pct_')[0].tolist()
+        high = hit_type_matrix(df_team, [f'{ht}_high' for ht in hit_types], prefix='avg_pct_')[0].tolist()
+        ax.fill_between(angles, low + low[:1], high + high[:1], color='red', alpha=0.1, linewidth=0,
+                        label=f"{bootstrap.CONFIDENCE:.0%} CI")
     
     ax.set_xticks(angles[:-1])
     ax.set_xticklabels(hit_types)
-    ax.set_yticklabels([f"{int(x*100)}%" for x in ax.get_yticks()])
-    plt.title(f"Team Average Hit Type Percentages - Team {team.upper()}")
-    plt.legend()
+    set_percent_labels(ax)
+    ax.set_title(f"Team Average Hit Type Percentages - Team {team.upper()}")
+    ax.legend()
     
-    filename = os.path.join(PLOTS_DIR, f"team_radial_{team.upper()}.png")
-    plt.savefig(filename, bbox_inches='tight')
-    plt.close()
+    filename = os.path.join(plots_dir, f"team_radial_{team.upper()}.png")
+    fig.savefig(filename, bbox_inches='tight')
     print(f"Team radial plot saved as {filename}")
+    return filename
 
 
-def boxplot_team_comparison(df_team_a, df_team_b, stat, team_names):
-    team_a_name, team_b_name = team_names
-
-    # copy dataframes
-    df_a = df_team_a.copy()
-    df_b = df_team_b.copy()
+# team_intervals, indexed like team_players, adds each team's average with
+# its bootstrap interval (avg_<stat>, avg_<stat>_low and avg_<stat>_high)
+def boxplot_team_comparison(team_players, stat, team_intervals=None, plots_dir=PLOTS_DIR):
+    team_names = list(team_players.keys())
 
     # only keep the stat we want
-    if stat not in df_a.columns or stat not in df_b.columns:
+    if any(stat not in df_team.columns for df_team in team_players.values()):
         print(f"Warning: Stat {stat} not found in one of the teams. Skipping comparison.")
         return
 
-    df_a = df_a[[stat]].copy()
-    df_b = df_b[[stat]].copy()
-
-    # add team column
-    df_a['team'] = team_a_name
-    df_b['team'] = team_b_name
-
-    # combine
-    df = pd.concat([df_a, df_b], ignore_index=True)
+    # one row per player with the team column added, for every team
+    df = pd.concat([df_team[[stat]].assign(team=team) for team, df_team in team_players.items()],
+                   ignore_index=True)
 
-    # plot
-    plt.figure(figsize=(8, 5))
-    sns.boxplot(x='team', y=stat, data=df)
-    plt.title(f"{stat.replace('_',' ').title()} Comparison: {team_a_name} vs {team_b_name}")
-    plt.ylabel(stat.replace('_',' ').title())
+    # plot, wider for a whole league
+    fig = Figure(figsize=(max(8, len(team_names) * 0.8), 5))
+    ax = fig.add_subplot(111)
+    sns.boxplot(x='team', y=stat, data=df, order=team_names, ax=ax)
+    if team_intervals is not None:
+        rows = team_intervals.reindex(team_names)
+        mean = rows[f"avg_{stat}"].to_numpy(dtype=float)
+        errors = np.abs(rows[[f"avg_{stat}_low", f"avg_{stat}_high"]].to_numpy(dtype=float).T - mean)
+        ax.errorbar(np.arange(len(team_names)), mean, yerr=errors, fmt='D', color='black', capsize=4,
+                    label=f"Team average, {bootstrap.CONFIDENCE:.0%} CI")
+        ax.legend(loc='best')
+    if len(team_names) == 2:
+        title = f"{team_names[0]} vs {team_names[1]}"
+        suffix = f"{team_names[0].lower()}_vs_{team_names[1].lower()}"
+    else:
+        title = "All Teams"
+        suffix = "all_teams"
+    ax.set_title(f"{stat.replace('_',' ').title()} Comparison: {title}")
+    ax.set_ylabel(stat.replace('_',' ').title())
     
-    filename = os.path.join(PLOTS_DIR, f"boxplot_{stat}_{team_a_name.lower()}_vs_{team_b_name.lower()}.png")
-    plt.savefig(filename, bbox_inches='tight')
-    plt.close()
+    filename = os.path.join(plots_dir, f"boxplot_{stat}_{suffix}.png")
+    fig.savefig(filename, bbox_inches='tight')
     print(f"Team comparison boxplot saved as {filename}")
+    return filename
 
 def service_ratio_plot(df_team, team, team_dir):
-    total_aces = df_team['total_service_aces'].sum(skipna=True)
-    total_errors = df_team['total_service_errors'].sum(skipna=True)
-    ratio = total_aces / total_errors if total_errors > 0 else 0
+    ratio = df_team['service_ace_ratio'].iloc[0]
 
-    plt.figure(figsize=(6,5))
-    sns.barplot(x=[f"Team {team.upper()}"], y=[ratio], color='skyblue')
-    plt.ylabel("Service Ace/Error Ratio")
-    plt.title(f"Service Ace/Error Ratio - Team {team.upper()}")
+    fig = Figure(figsize=(6,5))
+    ax = fig.add_subplot(111)
+    sns.barplot(x=[f"Team {team.upper()}"], y=[ratio], color='skyblue', ax=ax)
+    ax.set_ylabel("Service Ace/Error Ratio")
+    ax.set_title(f"Service Ace/Error Ratio - Team {team.upper()}")
 
     filename = os.path.join(team_dir, f"service_ratio_team_{team.upper()}.png")
-    plt.savefig(filename, bbox_inches='tight')
-    plt.close()
+    fig.savefig(filename, bbox_inches='tight')
     print(f"Service ratio plot saved as {filename}")
+    return filename
+
+
+# attacks per court zone (rows) and hit type (columns) as a heatmap, from
+# a zone x hit type x outcome slice of court_zones.ZoneCube. the kill rate
+# of each zone is part of its row label
+def zone_heatmap(counts, hit_types, outcomes, title, filename):
+    attacks = counts.sum(axis=2)
+    kills = counts[:, :, outcomes.index("kill")].sum(axis=1)
+    zone_totals = attacks.sum(axis=1)
+    zones = np.arange(1, len(attacks) + 1)
+    kill_rate = np.divide(kills, zone_totals, out=np.full(len(zones), np.nan), where=zone_totals > 0)
+
+    labels = [f"{zone}" if np.isnan(rate) else f"{zone} ({rate:.0%} kills)" for zone, rate in zip(zones, kill_rate)]
+
+    fig = Figure(figsize=(7, max(4, len(zones) * 0.3)))
+    ax = fig.add_subplot(111)
+    sns.heatmap(attacks, annot=True, fmt="d", cmap="Reds", cbar_kws={'label': 'Attacks'},
+                xticklabels=hit_types, yticklabels=labels, ax=ax)
+    ax.set_xlabel("Hit Type")
+    ax.set_ylabel("Landing Zone")
+    ax.set_title(title)
+
+    fig.savefig(filename, bbox_inches='tight')
+    print(f"Zone heatmap saved as {filename}")
+    return filename
+
+
+def team_zone_heatmap(counts, hit_types, outcomes, team, team_dir):
+    filename = os.path.join(team_dir, f"zone_heatmap_team{team.upper()}.png")
+    return zone_heatmap(counts, hit_types, outcomes, f"Attacks by Landing Zone - Team {team.upper()}", filename)
+
+
+def player_zone_heatmap(counts, hit_types, outcomes, team, jersey, team_dir):
+    zone_dir = os.path.join(team_dir, "zones")
+    os.makedirs(zone_dir, exist_ok=True)
+    filename = os.path.join(zone_dir, f"zone_heatmap_player_{jersey}.png")
+    return zone_heatmap(counts, hit_types, outcomes, f"Attacks by Landing Zone - Team {team.upper()} Player {jersey}", filename)
+
+
+# " (95% CI low to high)" for every pair of bounds, or "" where there is none
+def interval_text(low, high):
+    low = np.asarray(low, dtype=float)
+    high = np.asarray(high, dtype=float)
+    text = np.char.add(np.char.add(f" ({bootstrap.CONFIDENCE:.0%} CI ", np.char.mod("%.2f", low)),
+                       np.char.add(" to ", np.char.add(np.char.mod("%.2f", high), ")")))
+    return np.where(np.isnan(low) | np.isnan(high), "", text)
+
+
+# the player section of the scouting report. every field is formatted as a
+# whole column and the player blocks are joined in one go
+def player_details_text(df_players):
+    if df_players.empty:
+        return ""
+    jersey = df_players['jersey_number'].astype(str)
+    hits = df_players['total_hits'].fillna(0).astype(int).astype(str)
+    kills = df_players['total_kills'].fillna(0).astype(int).astype(str)
+    errors = df_players['total_hit_errors'].fillna(0).astype(int).astype(str)
+    efficiency = pd.Series(np.char.mod("%.2f", df_players['hitting_efficiency'].to_numpy(dtype=float, na_value=np.nan)),
+                           index=df_players.index)
+    if 'hitting_efficiency_low' in df_players.columns:
+        efficiency += interval_text(df_players['hitting_efficiency_low'].to_numpy(dtype=float, na_value=np.nan),
+                                    df_players['hitting_efficiency_high'].to_numpy(dtype=float, na_value=np.nan))
+        # players with too few attempts have an efficiency but no interval
+        attempts = df_players['total_hits'].fillna(0).to_numpy()
+        short = (attempts > 0) & (attempts < bootstrap.MIN_ATTEMPTS)
+        efficiency += np.where(short, f" (no CI below {bootstrap.MIN_ATTEMPTS} attempts)", "")
+    blocks = ("Player " + jersey + ":\n"
+              + "  Total Hits: " + hits + "\n"
+              + "  Total Kills: " + kills + "\n"
+              + "  Total Hit Errors: " + errors + "\n"
+              + "  Hitting Efficiency: " + efficiency + "\n\n")
+    return "".join(blocks)
+
 
+# the rally tendencies section of the scouting report, one probability
+# matrix per transition of sequences.TRANSITIONS
+def tendencies_text(tendencies):
+    titles = {
+        "pass_to_set": "Set choice after each pass rating",
+        "set_to_hit": "Attack after each set",
+        "hit_to_outcome": "Outcome of each attack",
+        "hit_to_next_pass": "Opponent's next pass after each attack",
+    }
+    text = "Rally Tendencies (share of each row):\n"
+    for transition, matrix in tendencies.items():
+        table = matrix.to_string(float_format="{:.2f}".format)
+        text += f"  {titles.get(transition, transition)}:\n"
+        text += "".join(f"    {line}\n" for line in table.splitlines()) + "\n"
+    return text
 
-def create_scouting_report(df_players, df_team, team, team_dir):
+
+# the interval of one team summary value, if the summary has one
+def team_interval_text(summary, column):
+    if f"{column}_low" not in summary.index:
+        return ""
+    return str(interval_text(summary[f"{column}_low"], summary[f"{column}_high"]))
+
+
+def create_scouting_report(df_players, df_team, team, team_dir, tendencies=None):
     df_team_players = df_players[df_players['team_name'].str.lower() == team.lower()]
+    summary = df_team.iloc[0]
     
     report_filename = os.path.join(team_dir, f"scouting_report_team_{team.upper()}.txt")
     with open(report_filename, "w") as f:
         f.write(f"Scouting Report - Team {team.upper()}\n")
         f.write("="*50 + "\n\n")
-        f.write(f"Number of players: {len(df_team_players)}\n\n")
+        f.write(f"Number of players: {summary['num_players']}\n\n")
         
         # team summary stats
         f.write("Team Summary Statistics:\n")
-        f.write(f"  Total Hits: {df_team_players['total_hits'].sum(skipna=True)}\n")
-        f.write(f"  Total Kills: {df_team_players['total_kills'].sum(skipna=True)}\n")
-        f.write(f"  Total Hit Errors: {df_team_players['total_hit_errors'].sum(skipna=True)}\n")
-        f.write(f"  Average Hitting Efficiency: {df_team_players['hitting_efficiency'].mean():.2f}\n")
+        f.write(f"  Total Hits: {summary['total_hits']}\n")
+        f.write(f"  Total Kills: {summary['total_kills']}\n")
+        f.write(f"  Total Hit Errors: {summary['total_hit_errors']}\n")
+        f.write(f"  Average Hitting Efficiency: {summary['avg_hitting_efficiency']:.2f}"
+                f"{team_interval_text(summary, 'avg_hitting_efficiency')}\n")
         
         # serving stats
-        total_aces = df_team['total_service_aces'].sum(skipna=True) if 'total_service_aces' in df_team.columns else 0
-        total_errors = df_team['total_service_errors'].sum(skipna=True) if 'total_service_errors' in df_team.columns else 0
-        service_ratio = total_aces / total_errors if total_errors > 0 else 0
-        f.write(f"  Total Service Aces: {total_aces}\n")
-        f.write(f"  Total Service Errors: {total_errors}\n")
-        f.write(f"  Service Ace/Error Ratio: {service_ratio:.2f}\n\n")
+        f.write(f"  Total Service Aces: {summary['total_service_aces']}\n")
+        f.write(f"  Total Service Errors: {summary['total_service_errors']}\n")
+        f.write(f"  Service Ace/Error Ratio: {summary['service_ace_ratio']:.2f}\n\n")
         
         # team hit type stats
         hit_types = ['tip', 'roll_shot', 'free_ball', 'off_speed', 'hit', 'overpass', 'blocked']
-        team_hit_type_avg = df_team_players[[f'pct_{ht}' for ht in hit_types]].mean()
         for ht in hit_types:
-            f.write(f"  {ht}: {team_hit_type_avg[f'pct_{ht}']:.2f}\n")
+            f.write(f"  {ht}: {summary[f'avg_pct_{ht}']:.2f}{team_interval_text(summary, f'avg_pct_{ht}')}\n")
         f.write("\n")
         
-        # player stats
+        # player stats, formatted column by column and written at once
         f.write("Player Details:\n")
-        for _, player in df_team_players.iterrows():
-            f.write(f"Player {player['jersey_number']}:\n")
-            f.write(f"  Total Hits: {player.get('total_hits', 0)}\n")
-            f.write(f"  Total Kills: {player.get('total_kills', 0)}\n")
-            f.write(f"  Total Hit Errors: {player.get('total_hit_errors', 0)}\n")
-            f.write(f"  Hitting Efficiency: {player.get('hitting_efficiency', 0):.2f}\n")
-            f.write("\n")
+        f.write(player_details_text(df_team_players))
+
+        # transition probabilities between the touches of a rally
+        if tendencies:
+            f.write(tendencies_text(tendencies))
         
         # plot info
         f.write("Plots included:\n")
@@ -177,35 +307,188 @@ def create_scouting_report(df_players, df_team, team, team_dir):
         f.write(f"  Team radial plot: team_radial_{team.upper()}.png\n")
     
     print(f"Scouting report saved as {report_filename}")
+    return report_filename
+
+
+# run one render job in a worker process and time it
+def run_render_job(name, team, func, args):
+    start = time.perf_counter()
+    path = func(*args)
+    return {"job": name, "team": team, "path": path, "seconds": time.perf_counter() - start}
+
+
+# render every plot and report in a pool of worker processes. each job
+# draws on its own Figure, so the jobs share no pyplot state. returns a
+# manifest with the file written by each job and how long it took
+def render_jobs(jobs, workers=None):
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_render_job, *job) for job in jobs]
+        return [future.result() for future in futures]
+
+
+# version of the rendering code, any change to one of RENDER_MODULES
+# re-renders everything
+def code_version():
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    h = hashlib.sha256()
+    for module in RENDER_MODULES:
+        with open(os.path.join(source_dir, module), "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+# feed one job argument into the hash. frames are hashed by content, so
+# rerunning on the same numbers gives the same key
+def hash_argument(h, value):
+    if isinstance(value, pd.Series):
+        value = value.to_frame()
+    if isinstance(value, np.ndarray):
+        h.update(f"{value.dtype}{value.shape}".encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, pd.DataFrame):
+        h.update(repr(list(value.columns)).encode())
+        h.update(repr(list(value.dtypes)).encode())
+        h.update(pd.util.hash_pandas_object(value, index=False).to_numpy().tobytes())
+    elif isinstance(value, dict):
+        h.update(f"dict{len(value)}".encode())
+        for key, item in value.items():
+            hash_argument(h, key)
+            hash_argument(h, item)
+    elif isinstance(value, (list, tuple)):
+        h.update(f"{type(value).__name__}{len(value)}".encode())
+        for item in value:
+            hash_argument(h, item)
+    else:
+        h.update(repr(value).encode())
+
+
+# cache key of a render job: its data slice plus the rendering code version
+def render_job_key(name, team, func, args, version):
+    h = hashlib.sha256()
+    h.update(f"{version}:{name}:{team}:{func.__name__}".encode())
+    hash_argument(h, args)
+    return h.hexdigest()
+
 
+def load_render_cache(path=RENDER_CACHE):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        cache = json.load(f)
+    # evict the entries whose files were deleted
+    return {job_id: entry for job_id, entry in cache.items()
+            if entry.get("path") and os.path.exists(entry["path"])}
+
+
+def save_render_cache(cache, path=RENDER_CACHE):
+    with open(path, "w") as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+
+
+# delete the files of the previous cache entries whose job is no longer
+# run, like the plots of a team that left the data, unless a current job
+# wrote the same file
+def remove_stale_renders(previous, job_ids, current_paths):
+    for job_id in previous.keys() - job_ids:
+        path = previous[job_id]["path"]
+        if path not in current_paths and os.path.exists(path):
+            os.remove(path)
+            print(f"Removed stale {path}")
+
+
+# render only the jobs whose key changed since the last run, the other
+# artifacts are reused from disk. the cache ends up with an entry for every
+# current job and nothing else
+def render_with_cache(jobs, workers=None, use_cache=True, cache_path=RENDER_CACHE):
+    version = code_version()
+    # read even without the cache, to find the artifacts of jobs that are gone
+    previous = load_render_cache(cache_path)
+    cache = dict(previous) if use_cache else {}
+
+    keys = [render_job_key(*job, version) for job in jobs]
+    pending = []
+    manifest = [None] * len(jobs)
+    for i, (job, key) in enumerate(zip(jobs, keys)):
+        name, team = job[0], job[1]
+        entry = cache.get(f"{name}:{team}")
+        if entry and entry["key"] == key:
+            manifest[i] = {"job": name, "team": team, "path": entry["path"], "seconds": 0.0, "cached": True}
+        else:
+            pending.append(i)
+
+    rendered = render_jobs([jobs[i] for i in pending], workers) if pending else []
+    for i, result in zip(pending, rendered):
+        manifest[i] = {**result, "cached": False}
+        if result["path"]:
+            cache[f"{result['job']}:{result['team']}"] = {"key": keys[i], "path": result["path"]}
+
+    job_ids = {f"{name}:{team}" for name, team, *_ in jobs}
+    remove_stale_renders(previous, job_ids, {entry["path"] for entry in manifest})
+    cache = {job_id: entry for job_id, entry in cache.items() if job_id in job_ids}
+    save_render_cache(cache, cache_path)
+    return manifest
+
+
+# team_tables maps each team code to its summary frame, one report per team.
+# with a court_zones.ZoneCube, every team also gets a zone heatmap, and every
+# player too with player_zones. with sequences.TransitionCounts the reports
+# get the rally tendencies. everything is written under plots_dir, which
+# the render jobs get as an argument because they run in other processes
+def generate_visuals_and_scouting_report(df_players, team_tables, workers=None, use_cache=True, zone_cube=None,
+                                         transitions=None, player_zones=False, plots_dir=PLOTS_DIR):
+    os.makedirs(plots_dir, exist_ok=True)
+    jobs = []
+    team_players = {}
+
+    # bootstrap intervals of every player and team average, see bootstrap.py.
+    # the player statistics and team averages are replaced by the estimates
+    # the intervals belong to, so the reports, the radial plots and the
+    # boxplot all use one definition: every player with an attempt counts
+    player_ci, team_ci = bootstrap.confidence_intervals(df_players)
+    df_players = df_players.drop(columns=bootstrap.STATS).join(player_ci)
 
-def generate_visuals_and_scouting_report(df_players, team_tables):
     for team, df_team in team_tables.items():
-        print(f"Generating visuals and report for Team {team.upper()}...")
+        print(f"Scheduling visuals and report for Team {team.upper()}...")
+        df_team = pd.concat([df_team.drop(columns=team_ci.columns, errors='ignore').reset_index(drop=True),
+                             team_ci.reindex([team]).reset_index(drop=True)], axis=1)
 
         # extract players for current team
         df_players_team = df_players[df_players['team_name'].str.lower() == team.lower()]
-        team_dir = create_team_dir(team)
-
-        # player hit type radial plot
-        player_radial_plot_hit_types(df_players_team, team, team_dir)
-
-        # team hit type radial plot
-        team_radial_plot_hit_types(df_players_team, team)
+        team_players[team.upper()] = df_players_team
+        team_dir = create_team_dir(team, plots_dir)
 
-        # service ace/error ratio plot (from team table)
-        service_ratio_plot(df_team, team, team_dir)
+        jobs += [
+            # player hit type radial plot
+            ("player_radial", team, player_radial_plot_hit_types, (df_players_team, team, team_dir)),
+            # team hit type radial plot
+            ("team_radial", team, team_radial_plot_hit_types, (df_team, team, plots_dir)),
+            # service ace/error ratio plot (from team summary)
+            ("service_ratio", team, service_ratio_plot, (df_team, team, team_dir)),
+            # create scouting report (pass both player-level and team-level)
+            ("scouting_report", team, create_scouting_report,
+             (df_players_team, df_team, team, team_dir,
+              transitions.team_matrices(team) if transitions is not None else None)),
+        ]
 
-        # create scouting report (pass both player-level and team-level)
-        create_scouting_report(df_players_team, df_team, team, team_dir)
+        if zone_cube is not None:
+            hit_types, outcomes = list(zone_cube.hit_types), list(zone_cube.outcomes)
+            jobs.append(("team_zone_heatmap", team, team_zone_heatmap,
+                         (zone_cube.team_counts(team), hit_types, outcomes, team, team_dir)))
+            player_rows = np.flatnonzero(zone_cube.teams == team) if player_zones else []
+            for i in player_rows:
+                jersey = int(zone_cube.jerseys[i])
+                jobs.append(("player_zone_heatmap", f"{team}_{jersey}", player_zone_heatmap,
+                             (zone_cube.counts[i], hit_types, outcomes, team, jersey, team_dir)))
 
-        print(f"Completed visuals and report for Team {team.upper()}\n")
+    # comparison boxplot for hitting efficiency across all teams
+    if len(team_players) >= 2:
+        jobs.append(("boxplot", None, boxplot_team_comparison,
+                     (team_players, 'hitting_efficiency', team_ci.rename(index=str.upper), plots_dir)))
 
-    # comparison boxplot for hitting efficiency if two teams
-    team_names = list(team_tables.keys())
-    if len(team_names) >= 2:
-        df_team_a = df_players[df_players['team_name'].str.lower() == team_names[0].lower()]
-        df_team_b = df_players[df_players['team_name'].str.lower() == team_names[1].lower()]
-        boxplot_team_comparison(df_team_a, df_team_b, 'hitting_efficiency', team_names)
+    manifest = render_with_cache(jobs, workers, use_cache, os.path.join(plots_dir, ".render_cache.json"))
+    for entry in manifest:
+        status = "cached" if entry["cached"] else f"{entry['seconds']:5.2f}s"
+        print(f"  {entry['job']:<16} {status:>6}  {entry['path']}")
 
     print("All visuals and scouting reports generated!")
+    return manifest